@@ -0,0 +1,12 @@
+# -*- coding:utf-8 -*-
+from typing import List
+
+from CompanyInformation import CompanyInformationRepository
+
+
+class AllCompanies:
+    @staticmethod
+    def Get(repository: CompanyInformationRepository) -> List[int]:
+        # documents.csvにある全提出者(Nikkei255/TopixCore30と同じく4桁の銘柄コードで返す)
+        # 5桁目が0以外のコード(優先株など)は4桁に戻せないので除く
+        return [int(sec_code) // 10 for sec_code in repository.document_table.sec_codes if sec_code % 10 == 0]
@@ -0,0 +1,214 @@
+# -*- coding:utf-8 -*-
+import os
+import json
+import bisect
+import threading
+from typing import Dict, List
+
+
+# 応答時間のヒストグラム(境界は固定なので、ワーカープロセスの分を足し合わせられる)
+class LatencyHistogram:
+    BOUNDS: List[float] = [0.001 * (1.25 ** i) for i in range(53)]  # 1ms - 約110s (秒)
+
+    def __init__(self):
+        super().__init__()
+
+        self.counts = [0] * (len(LatencyHistogram.BOUNDS) + 1)  # 最後は上限超え
+        self.count = 0
+        self.sum = 0.0
+
+    def Observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LatencyHistogram.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def Merge(self, snapshot: dict) -> None:
+        for index, count in enumerate(snapshot['counts']):
+            self.counts[index] += count
+        self.count += snapshot['count']
+        self.sum += snapshot['sum']
+
+    # 分位点(バケット内は線形補間、Prometheusのhistogram_quantileと同じ考え方)
+    def GetQuantile(self, quantile: float) -> float:
+        if self.count == 0:
+            return None
+        rank = quantile * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                lower = LatencyHistogram.BOUNDS[index - 1] if index > 0 else 0.0
+                if index >= len(LatencyHistogram.BOUNDS):
+                    return lower
+                return lower + (LatencyHistogram.BOUNDS[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return LatencyHistogram.BOUNDS[-1]
+
+    def GetSnapshot(self) -> dict:
+        return {'counts': list(self.counts), 'count': self.count, 'sum': self.sum}
+
+
+# エンドポイントごとの呼び出し回数、送受信バイト数、文字数、応答時間、リトライ、キャッシュヒット、エラー(スレッドセーフ)
+class ApiMetrics:
+    COUNTERS = ['calls', 'request_bytes', 'response_bytes', 'chars', 'cache_hits', 'sent', 'retries', 'errors', 'empty_results']
+    HISTOGRAMS = ['latency', 'send_latency']  # 呼び出し全体(レート制限の待ちやリトライ込み)と、送信1回ごと
+    QUANTILES = [0.5, 0.95, 0.99]
+
+    def __init__(self):
+        super().__init__()
+
+        self.__endpoints: Dict[str, dict] = {}
+        self.__lock = threading.Lock()
+
+    def __GetEndpoint(self, name: str) -> dict:
+        endpoint = self.__endpoints.get(name)
+        if endpoint is None:
+            endpoint = {counter: 0 for counter in ApiMetrics.COUNTERS}
+            endpoint.update({histogram: LatencyHistogram() for histogram in ApiMetrics.HISTOGRAMS})
+            self.__endpoints[name] = endpoint
+        return endpoint
+
+    # リクエストボディ中の文字列の文字数(文の配列も数える)
+    @staticmethod
+    def GetTextLength(body: dict) -> int:
+        length = 0
+        for value in body.values():
+            if isinstance(value, str):
+                length += len(value)
+            elif isinstance(value, list):
+                length += sum(len(item) for item in value if isinstance(item, str))
+        return length
+
+    def Add(self, name: str, counter: str, value: int = 1) -> None:
+        with self.__lock:
+            self.__GetEndpoint(name)[counter] += value
+
+    # 1回の送信(リトライや401での再送も1回と数える)
+    def AddSend(self, name: str, seconds: float, retry: bool) -> None:
+        with self.__lock:
+            endpoint = self.__GetEndpoint(name)
+            endpoint['sent'] += 1
+            if retry:
+                endpoint['retries'] += 1
+            endpoint['send_latency'].Observe(seconds)
+
+    # 1回の呼び出しの結果をまとめて記録
+    def AddCall(self, name: str, request_bytes: int, chars: int, response_bytes: int, seconds: float, sent: bool, failed: bool) -> None:
+        with self.__lock:
+            endpoint = self.__GetEndpoint(name)
+            endpoint['calls'] += 1
+            endpoint['request_bytes'] += request_bytes
+            endpoint['chars'] += chars
+            endpoint['response_bytes'] += response_bytes
+            if not sent and not failed:
+                endpoint['cache_hits'] += 1  # メモかレスポンスキャッシュで済んだ
+            if failed:
+                endpoint['errors'] += 1
+            endpoint['latency'].Observe(seconds)
+
+    def __GetSnapshot(self) -> Dict[str, dict]:
+        snapshot = {}
+        for name, endpoint in self.__endpoints.items():
+            snapshot[name] = {counter: endpoint[counter] for counter in ApiMetrics.COUNTERS}
+            snapshot[name].update({histogram: endpoint[histogram].GetSnapshot() for histogram in ApiMetrics.HISTOGRAMS})
+        return snapshot
+
+    # 足し合わせ可能な形(JSONにもpickleにもできる)
+    def GetSnapshot(self) -> Dict[str, dict]:
+        with self.__lock:
+            return self.__GetSnapshot()
+
+    # スナップショットを取り、数え直す(ワーカープロセスから親へ差分を渡す)
+    def Collect(self) -> Dict[str, dict]:
+        with self.__lock:
+            snapshot = self.__GetSnapshot()
+            self.__endpoints = {}
+            return snapshot
+
+    def Merge(self, snapshot: Dict[str, dict]) -> None:
+        with self.__lock:
+            for name, values in snapshot.items():
+                endpoint = self.__GetEndpoint(name)
+                for counter in ApiMetrics.COUNTERS:
+                    endpoint[counter] += values[counter]
+                for histogram in ApiMetrics.HISTOGRAMS:
+                    endpoint[histogram].Merge(values[histogram])
+
+    # 分位点(秒)
+    def GetQuantiles(self, name: str, histogram: str = 'latency') -> Dict[float, float]:
+        with self.__lock:
+            latency = self.__GetEndpoint(name)[histogram]
+            return {quantile: latency.GetQuantile(quantile) for quantile in ApiMetrics.QUANTILES}
+
+    def GetEndpoints(self) -> List[str]:
+        with self.__lock:
+            return sorted(self.__endpoints.keys())
+
+    # 人が読む用のJSON(バケットの代わりにp50/p95/p99を出す)
+    def ToJson(self) -> str:
+        result = {}
+        for name, values in sorted(self.GetSnapshot().items()):
+            result[name] = {counter: values[counter] for counter in ApiMetrics.COUNTERS}
+            for histogram in ApiMetrics.HISTOGRAMS:
+                latency = LatencyHistogram()
+                latency.Merge(values[histogram])
+                result[name][histogram] = dict({'count': latency.count, 'sum': latency.sum},
+                                               **{'p{0:g}'.format(quantile * 100): latency.GetQuantile(quantile) for quantile in ApiMetrics.QUANTILES})
+        return json.dumps(result, ensure_ascii=False, indent=2)
+
+    # Prometheusのテキスト形式(node_exporterのtextfile collectorなどで読める)
+    def ToPrometheus(self) -> str:
+        snapshot = self.GetSnapshot()
+        lines: List[str] = []
+        for counter in ApiMetrics.COUNTERS:
+            metric = 'cotoha_api_{0}_total'.format(counter)
+            lines.append('# TYPE {0} counter'.format(metric))
+            for name, values in sorted(snapshot.items()):
+                lines.append('{0}{{endpoint="{1}"}} {2}'.format(metric, name, values[counter]))
+        for histogram in ApiMetrics.HISTOGRAMS:
+            metric = 'cotoha_api_{0}_seconds'.format(histogram)
+            lines.append('# TYPE {0} histogram'.format(metric))
+            for name, values in sorted(snapshot.items()):
+                cumulative = 0
+                for bound, count in zip(LatencyHistogram.BOUNDS, values[histogram]['counts']):
+                    cumulative += count
+                    lines.append('{0}_bucket{{endpoint="{1}",le="{2:.6g}"}} {3}'.format(metric, name, bound, cumulative))
+                lines.append('{0}_bucket{{endpoint="{1}",le="+Inf"}} {2}'.format(metric, name, values[histogram]['count']))
+                lines.append('{0}_sum{{endpoint="{1}"}} {2}'.format(metric, name, values[histogram]['sum']))
+                lines.append('{0}_count{{endpoint="{1}"}} {2}'.format(metric, name, values[histogram]['count']))
+        return '\n'.join(lines) + '\n'
+
+    # ファイルへ書き出す(.promならPrometheus、それ以外はJSON)
+    # 読み手が書きかけのファイルを見ないように、一時ファイルから置き換える
+    def Write(self, file_path: str) -> None:
+        text = self.ToPrometheus() if file_path.endswith('.prom') else self.ToJson()
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, mode='w', encoding='UTF-8') as f:
+            f.write(text)
+        os.replace(temporary_path, file_path)
+
+
+# 一定間隔でメトリクスをファイルへ書き出すスレッド(closeで最後の値を書いて止まる)
+class MetricsExporter:
+    def __init__(self, metrics: ApiMetrics, file_path: str, interval: float = 60):
+        super().__init__()
+
+        self.metrics = metrics
+        self.file_path = file_path
+        self.interval = interval  # 秒, 0なら終了時だけ
+        self.__stopped = threading.Event()
+        self.__thread = None
+        if interval > 0:
+            self.__thread = threading.Thread(target=self.__Run, daemon=True)
+            self.__thread.start()
+
+    def __Run(self) -> None:
+        while not self.__stopped.wait(self.interval):
+            self.metrics.Write(self.file_path)
+
+    def close(self) -> None:
+        if self.__stopped.is_set():
+            return
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.metrics.Write(self.file_path)
@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+import os
+import json
+import threading
+from typing import Dict, List
+
+
+# 会社ごとの処理結果を追記専用で保存するジャーナル(1行1社のJSON Lines)
+class BatchJournal:
+    def __init__(self, file_path: str):
+        super().__init__()
+
+        self.file_path = file_path
+        self.__records: Dict[tuple, dict] = {}
+        self.__lock = threading.Lock()
+
+        if os.path.exists(file_path):
+            with open(file_path, mode='r', encoding='UTF-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 書き込み途中で落ちた行は無視
+                    self.__records[(record['code'], record['year'])] = record
+
+        self.__file = open(file_path, mode='a', encoding='UTF-8')
+        # 書き込み途中で落ちて改行のない行が残っていれば、次の記録がその行に続かないよう改行しておく
+        if os.path.getsize(file_path) > 0:
+            with open(file_path, mode='rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+            if torn:
+                self.__file.write('\n')
+                self.__file.flush()
+
+    def IsFinished(self, code: int, year: int) -> bool:
+        return (code, year) in self.__records
+
+    def Get(self, code: int, year: int) -> dict:
+        return self.__records.get((code, year))
+
+    # 1社分を追記し、ディスクへ確実に書き出す
+    def Append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.__lock:
+            self.__file.write(line)
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__records[(record['code'], record['year'])] = record
+
+    # 指定した銘柄コード順で記録を返す(未処理のコードは飛ばす)
+    def GetRecords(self, codes: List[int], year: int) -> List[dict]:
+        return [self.__records[(code, year)] for code in codes if (code, year) in self.__records]
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__file.close()
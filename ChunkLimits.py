@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import configparser
+from typing import Dict, List
+
+from TextDivider import TextDivider
+
+
+# エンドポイントごとの1リクエストあたりの文字数(config.iniの[Chunk Length]と[Chunk Max Length])
+class ChunkLimits:
+    ENDPOINTS = ['similarity', 'summary', 'sentiment', 'ne', 'userAttribute']
+    DEFAULT_LENGTHS = {'similarity': 1000, 'summary': 2000, 'sentiment': 2000, 'ne': 2000, 'userAttribute': 1000}
+
+    def __init__(self, lengths: Dict[str, int], max_lengths: Dict[str, int], summary_chars_per_sentence: int = 500):
+        super().__init__()
+
+        self.lengths = lengths
+        self.max_lengths = max_lengths  # APIが受け付ける入力長の上限
+        self.summary_chars_per_sentence = summary_chars_per_sentence  # 要約の文数 = チャンク長 / この値
+        for endpoint, length in lengths.items():
+            if length > max_lengths[endpoint]:
+                raise Exception('ChunkLimits()', '{0}: {1} exceeds max length {2}'.format(endpoint, length, max_lengths[endpoint]))
+
+    # config.iniから生成(項目がなければ従来の値)
+    @staticmethod
+    def FromConfig(config_path: str) -> 'ChunkLimits':
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        lengths = {}
+        max_lengths = {}
+        for endpoint in ChunkLimits.ENDPOINTS:
+            lengths[endpoint] = config.getint('Chunk Length', endpoint, fallback=ChunkLimits.DEFAULT_LENGTHS[endpoint])
+            max_lengths[endpoint] = config.getint('Chunk Max Length', endpoint, fallback=lengths[endpoint])
+        SUMMARY_CHARS_PER_SENTENCE = config.getint('Chunk Length', 'Summary Chars Per Sentence', fallback=500)
+        return ChunkLimits(lengths, max_lengths, SUMMARY_CHARS_PER_SENTENCE)
+
+    def Get(self, endpoint: str) -> int:
+        return self.lengths[endpoint]
+
+    def GetSummarySentences(self, length: int) -> float:
+        return length / self.summary_chars_per_sentence
+
+
+if __name__ == '__main__':
+    # キャリブレーション: python ChunkLimits.py [会社数]
+    # config.iniのAPI(ローカルのスタブなど)へ実際に送り、エンドポイントごとに合計時間と呼び出し回数が最小になるチャンク長を探す
+    # 時間はTransportStageが記録する送信ごとの応答時間の合計で比べる(レート制限の待ちは呼び出し回数に比例するだけなので含めない)
+    from CompanyInformation import CompanyInformationRepository
+    from CompanyInformationQuery import CompanyInformationQuery
+    from TextAligner import TextAligner
+    from cotoha_api_python3 import CotohaApi
+    from cotoha_api_python3 import CacheStage
+    from cotoha_api_python3 import MemoStage
+    from cotoha_api_python3 import QuotaExceededError
+
+    APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + '/'
+    TARGET_YEAR = 2018
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    chunk_limits = ChunkLimits.FromConfig(APP_ROOT + 'config.ini')
+    cotoha_api = CotohaApi.FromConfig(APP_ROOT + 'config.ini')
+    # 計測なのでキャッシュとメモは通さない
+    cotoha_api.stages = [stage for stage in cotoha_api.stages if not isinstance(stage, (CacheStage, MemoStage))]
+
+    data_directory = os.path.join(os.path.dirname(__file__), 'data')
+    cir = {year: CompanyInformationRepository(data_directory, year) for year in [TARGET_YEAR - 1, TARGET_YEAR]}
+    eligible = CompanyInformationQuery(cir).GetEligible(TARGET_YEAR, None, {
+        TARGET_YEAR - 1: ['business_policy_environment_issue_etc'],
+        TARGET_YEAR: ['business_policy_environment_issue_etc', 'business_analysis_of_finance', 'business_research_and_development']})
+    infos = [(cir[TARGET_YEAR - 1].Get(int(code)), cir[TARGET_YEAR].Get(int(code))) for code in eligible.index[:count]]
+    if len(infos) == 0:
+        print('no documents under ' + data_directory)
+        sys.exit(1)
+
+    # 呼び出し回数, 送信ごとの応答時間の合計[s], 経過時間[s]
+    def Measure(endpoint: str, length: int) -> (int, float, float):
+        calls = 0
+        cotoha_api.metrics.Collect()
+        start = time.perf_counter()
+        for previous, current in infos:
+            if endpoint == 'similarity':
+                pairs = TextAligner.GetAlignedPairs(previous.business_policy_environment_issue_etc_text,
+                                                    current.business_policy_environment_issue_etc_text, length)
+                for pair in pairs:
+                    if not pair.identical:
+                        cotoha_api.similarity(pair.text1, pair.text2)
+                        calls += 1
+                continue
+
+            text = current.business_research_and_development_text if endpoint == 'ne' else current.business_analysis_of_finance_text
+            for sub_text in TextDivider.GetDividedSubstring(text, length):
+                if endpoint == 'summary':
+                    cotoha_api.summary(sub_text, chunk_limits.GetSummarySentences(length))
+                elif endpoint == 'sentiment':
+                    cotoha_api.sentiment(sub_text)
+                elif endpoint == 'ne':
+                    cotoha_api.ne(sub_text)
+                else:
+                    cotoha_api.userAttribute(sub_text)
+                calls += 1
+        elapsed = time.perf_counter() - start
+        metrics = cotoha_api.metrics.Collect()
+        return calls, metrics[endpoint]['send_latency']['sum'] if endpoint in metrics else 0.0, elapsed
+
+    print('{0} companies'.format(len(infos)))
+    best_lengths: Dict[str, int] = {}
+    try:
+        for endpoint in ChunkLimits.ENDPOINTS:
+            max_length = chunk_limits.max_lengths[endpoint]
+            candidates: List[int] = sorted({max(1, max_length * ratio // 8) for ratio in range(1, 9)})
+            results = {length: Measure(endpoint, length) for length in candidates}
+            for length, (calls, send_time, elapsed) in results.items():
+                print('{0:>13} length={1:>5}: {2:>5} calls, {3:>8.2f}ms sending, {4:>8.2f}ms elapsed'.format(
+                    endpoint, length, calls, send_time * 1000, elapsed * 1000))
+            # 送信時間の合計が最小に近いもの(計測誤差の範囲内なら呼び出し回数が少なく、長いもの)
+            best_time = min(send_time for calls, send_time, elapsed in results.values())
+            near_best = [length for length, (calls, send_time, elapsed) in results.items() if send_time <= best_time * 1.05 + 0.05]
+            best_lengths[endpoint] = min(near_best, key=lambda length: (results[length][0], -length))
+    except QuotaExceededError as e:
+        # 1日の上限に達したら、測り終えたエンドポイントの分だけ出す
+        print('<Error: quota> ' + str(e))
+
+    print('\n[Chunk Length]')
+    for endpoint in ChunkLimits.ENDPOINTS:
+        if endpoint in best_lengths:
+            print('{0}: {1}'.format(endpoint, best_lengths[endpoint]))
+    print('Summary Chars Per Sentence: {0}'.format(chunk_limits.summary_chars_per_sentence))
+    cotoha_api.close()
@@ -1,13 +1,16 @@
 # -*- coding:utf-8 -*-
 import os
+import json
+import numpy as np
 import pandas as pd
 
+from DocumentArchive import DocumentArchive
+
 
 class CompanyInformation:
     def __init__(self, name, year, net_sales, operating_income, ordinary_income, profit,
                  operating_income_on_sales, ordinary_income_on_sales, capital_ratio,
-                 business_policy_environment_issue_etc_text, business_risks_text, business_management_analysis_text,
-                 business_analysis_of_finance_text, business_overview_of_result_text, business_research_and_development_text):
+                 text_loader):
         super().__init__()
 
         self.name = name
@@ -19,25 +22,129 @@ class CompanyInformation:
         self.operating_income_on_sales = operating_income_on_sales
         self.ordinary_income_on_sales = ordinary_income_on_sales
         self.capital_ratio = capital_ratio
-        self.business_policy_environment_issue_etc_text = business_policy_environment_issue_etc_text
-        self.business_risks_text = business_risks_text
-        self.business_management_analysis_text = business_management_analysis_text
-        self.business_analysis_of_finance_text = business_analysis_of_finance_text
-        self.business_overview_of_result_text = business_overview_of_result_text
-        self.business_research_and_development_text = business_research_and_development_text
+
+        # 本文は参照されたときに初めて読み込む(text_loaderはセクション名を受け取り本文を返す)
+        self.__text_loader = text_loader
+        self.__texts = {}
+
+    def __GetText(self, section: str) -> str:
+        if section not in self.__texts:
+            self.__texts[section] = self.__text_loader(section)
+        return self.__texts[section]
+
+    @property
+    def business_policy_environment_issue_etc_text(self) -> str:
+        return self.__GetText('business_policy_environment_issue_etc')
+
+    @property
+    def business_risks_text(self) -> str:
+        return self.__GetText('business_risks')
+
+    @property
+    def business_management_analysis_text(self) -> str:
+        return self.__GetText('business_management_analysis')
+
+    @property
+    def business_analysis_of_finance_text(self) -> str:
+        return self.__GetText('business_analysis_of_finance')
+
+    @property
+    def business_overview_of_result_text(self) -> str:
+        return self.__GetText('business_overview_of_result')
+
+    @property
+    def business_research_and_development_text(self) -> str:
+        return self.__GetText('business_research_and_development')
+
+
+# documents.csvの列キャッシュ(列ごとの.npyをメモリマップし、sec_codeの二分探索で行を引く)
+class DocumentTable:
+    CACHE_VERSION = 1
+    NUMERIC_COLUMNS = ['fiscal_year', 'net_sales', 'operating_income', 'ordinary_income', 'profit',
+                       'operating_income_on_sales', 'ordinary_income_on_sales', 'capital_ratio']
+    TEXT_COLUMNS = ['filer_name', 'doc_id']
+
+    def __init__(self, csv_path: str, cache_directory_path: str):
+        super().__init__()
+
+        self.csv_path = csv_path
+        self.cache_directory_path = cache_directory_path
+        if not self.__IsCacheValid():
+            self.__BuildCache()
+
+        # sec_codeの索引だけ先に開き、列は使うときに開く
+        self.sec_codes = np.load(self.__GetColumnPath('sec_code'), mmap_mode='r')
+        self.__columns = {}
+
+    def __GetColumnPath(self, name: str) -> str:
+        return os.path.join(self.cache_directory_path, name + '.npy')
+
+    def __GetSourceStat(self) -> dict:
+        stat = os.stat(self.csv_path)
+        return {'version': DocumentTable.CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def __IsCacheValid(self) -> bool:
+        meta_path = os.path.join(self.cache_directory_path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, mode='r', encoding='UTF-8') as f:
+            return json.load(f) == self.__GetSourceStat()
+
+    # TSVを1度だけ読み込み、sec_code順に並べた列ファイルを作る
+    def __BuildCache(self) -> None:
+        csv_document = pd.read_csv(filepath_or_buffer=self.csv_path,
+                                   encoding='UTF-8',
+                                   sep='\t',
+                                   usecols=['sec_code'] + DocumentTable.NUMERIC_COLUMNS + DocumentTable.TEXT_COLUMNS)
+        csv_document = csv_document[csv_document['sec_code'].notna()]
+        csv_document = csv_document.assign(sec_code=csv_document['sec_code'].astype(np.int64))
+        # 同じsec_codeが複数ある場合は先頭の行を使う(従来のiloc[0]と同じ)
+        csv_document = csv_document.drop_duplicates(subset='sec_code', keep='first')
+        csv_document = csv_document.sort_values('sec_code', kind='stable')
+
+        if not os.path.exists(self.cache_directory_path):
+            os.makedirs(self.cache_directory_path)
+        np.save(self.__GetColumnPath('sec_code'), csv_document['sec_code'].to_numpy(dtype=np.int64))
+        for name in DocumentTable.NUMERIC_COLUMNS:
+            np.save(self.__GetColumnPath(name), pd.to_numeric(csv_document[name], errors='coerce').to_numpy(dtype=np.float64))
+        for name in DocumentTable.TEXT_COLUMNS:
+            np.save(self.__GetColumnPath(name), csv_document[name].fillna('').astype(str).to_numpy(dtype=str))
+
+        # 最後にメタ情報を書き、途中で落ちた場合は次回作り直す
+        with open(os.path.join(self.cache_directory_path, 'meta.json'), mode='w', encoding='UTF-8') as f:
+            json.dump(self.__GetSourceStat(), f)
+
+    def GetColumn(self, name: str) -> np.ndarray:
+        if name not in self.__columns:
+            self.__columns[name] = np.load(self.__GetColumnPath(name), mmap_mode='r')
+        return self.__columns[name]
+
+    # sec_codeの行番号(なければ-1)
+    def IndexOf(self, sec_code: int) -> int:
+        index = int(np.searchsorted(self.sec_codes, sec_code))
+        if index >= len(self.sec_codes) or self.sec_codes[index] != sec_code:
+            return -1
+        return index
+
+    def GetValue(self, name: str, index: int):
+        value = self.GetColumn(name)[index]
+        return str(value) if name in DocumentTable.TEXT_COLUMNS else value
 
 
 class CompanyInformationRepository:
     def __init__(self, data_directory_path: str, year: int):
         super().__init__()
 
-        # ファイルのロード
+        # ファイルのロード(初回のみTSVを変換し、以降は列キャッシュを使う)
         csv_path = os.path.join(data_directory_path, 'interim', str(year),
                                 'documents.csv')
-        self.csv_document = pd.read_csv(filepath_or_buffer=csv_path,
-                                        encoding='UTF-8',
-                                        sep='\t',
-                                        index_col='sec_code')  # use sec_code as index
+        cache_directory_path = os.path.join(data_directory_path, 'interim', str(year),
+                                            'documents_cache')
+        self.document_table = DocumentTable(csv_path, cache_directory_path)
+
+        # docs.packがあれば個別の.txtの代わりに使う(python DocumentArchive.py で作成)
+        archive_path = os.path.join(data_directory_path, 'interim', str(year), DocumentArchive.FILE_NAME)
+        self.document_archive = DocumentArchive(archive_path) if os.path.exists(archive_path) else None
 
         # メンバへ保存
         self.year = year
@@ -51,42 +158,24 @@ class CompanyInformationRepository:
 
     def Get(self, five_digit_code: int) -> CompanyInformation:
 
-        if five_digit_code not in self.csv_document.index:
+        index = self.document_table.IndexOf(five_digit_code)
+        if index < 0:
             # print(str(fiveDigitCode) + ': company information not exist')
             return
 
-        items = self.csv_document.loc[five_digit_code]
-        items = items if isinstance(items, pd.core.series.Series) else items.iloc[0]
+        items = self.document_table
 
-        name = items['filer_name']
-        year = items['fiscal_year']
-        net_sales = items['net_sales']  # 純売上高
-        operating_income = items['operating_income']  # 営業利益
-        ordinary_income = items['ordinary_income']  # 経常利益
-        profit = items['profit']  # 純利益
-        operating_income_on_sales = items['operating_income_on_sales']  # 営業利益率
-        ordinary_income_on_sales = items['ordinary_income_on_sales']  # 経常利益率
-        capital_ratio = items['capital_ratio']  # 自己資本比率
+        name = items.GetValue('filer_name', index)
+        year = items.GetValue('fiscal_year', index)
+        net_sales = items.GetValue('net_sales', index)  # 純売上高
+        operating_income = items.GetValue('operating_income', index)  # 営業利益
+        ordinary_income = items.GetValue('ordinary_income', index)  # 経常利益
+        profit = items.GetValue('profit', index)  # 純利益
+        operating_income_on_sales = items.GetValue('operating_income_on_sales', index)  # 営業利益率
+        ordinary_income_on_sales = items.GetValue('ordinary_income_on_sales', index)  # 経常利益率
+        capital_ratio = items.GetValue('capital_ratio', index)  # 自己資本比率
 
-        prefix = items['doc_id']
-
-        business_policy_environment_issue_etc_path = os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_business_policy_environment_issue_etc.txt')
-        business_risks_path = os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_business_risks.txt')
-        business_management_analysis_path = os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_business_management_analysis.txt')
-        business_analysis_of_finance_path = os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_business_analysis_of_finance.txt')
-        business_overview_of_result_path = os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_business_overview_of_result.txt')
-        business_research_and_development_path = os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_business_research_and_development.txt')
-
-        try:
-            business_policy_environment_issue_etc_text = self.__LoadFromFile(business_policy_environment_issue_etc_path)
-            business_risks_text = self.__LoadFromFile(business_risks_path)
-            business_management_analysis_text = self.__LoadFromFile(business_management_analysis_path)
-            business_analysis_of_finance_text = self.__LoadFromFile(business_analysis_of_finance_path)
-            business_overview_of_result_text = self.__LoadFromFile(business_overview_of_result_path)
-            business_research_and_development_text = self.__LoadFromFile(business_research_and_development_path)
-        except Exception:
-            print('could not read file. data directory may be broken: ' + self.data_directory_path)
-            return
+        prefix = items.GetValue('doc_id', index)
 
         return CompanyInformation(
             name,
@@ -98,9 +187,29 @@ class CompanyInformationRepository:
             operating_income_on_sales,
             ordinary_income_on_sales,
             capital_ratio,
-            business_policy_environment_issue_etc_text,
-            business_risks_text,
-            business_management_analysis_text,
-            business_analysis_of_finance_text,
-            business_overview_of_result_text,
-            business_research_and_development_text)
+            lambda section: self.__LoadSection(prefix, section))
+
+    def __GetSectionPath(self, prefix: str, section: str) -> str:
+        return os.path.join(self.data_directory_path, 'interim', str(self.year), 'docs', prefix + '_' + section + '.txt')
+
+    # セクションの本文をロード(読めなければ空文字)
+    def __LoadSection(self, prefix: str, section: str) -> str:
+        if self.document_archive is not None:
+            text = self.document_archive.Get(prefix, section)
+            if text is not None:
+                return text
+        path = self.__GetSectionPath(prefix, section)
+        try:
+            return self.__LoadFromFile(path)
+        except Exception:
+            print('could not read file. data directory may be broken: ' + self.data_directory_path)
+            return ''
+
+    # 本文を読まずに長さだけ調べる(0なら空、ファイルがなければ0)
+    def GetTextLength(self, prefix: str, section: str) -> int:
+        if self.document_archive is not None:
+            length = self.document_archive.GetLength(prefix, section)
+            if length is not None:
+                return length
+        path = self.__GetSectionPath(prefix, section)
+        return os.path.getsize(path) if os.path.exists(path) else 0
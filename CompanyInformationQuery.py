@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+import pandas as pd
+
+from CompanyInformation import DocumentTable
+from CompanyInformation import CompanyInformationRepository
+
+
+# 複数年度の列キャッシュをsec_codeで結合し、絞り込みを列演算でまとめて行う
+# 列名は '<列名>_<年度>' (例: net_sales_2018)
+class CompanyInformationQuery:
+    CHECK_COLUMNS = ['net_sales', 'operating_income', 'ordinary_income']
+
+    def __init__(self, repositories: Dict[int, CompanyInformationRepository]):
+        super().__init__()
+
+        self.repositories = repositories
+
+    @staticmethod
+    def GetColumnName(name: str, year: int) -> str:
+        return '{0}_{1}'.format(name, year)
+
+    def __GetYearTable(self, year: int) -> pd.DataFrame:
+        table = self.repositories[year].document_table
+        columns = {}
+        for name in DocumentTable.NUMERIC_COLUMNS + DocumentTable.TEXT_COLUMNS:
+            columns[CompanyInformationQuery.GetColumnName(name, year)] = np.asarray(table.GetColumn(name))
+        return pd.DataFrame(columns, index=pd.Index(np.asarray(table.sec_codes), name='sec_code'))
+
+    # 指定した全年度にある会社だけを結合する(codesを渡すとその順に並べる)
+    def GetTable(self, years: Iterable[int], codes: List[int] = None) -> pd.DataFrame:
+        tables = [self.__GetYearTable(year) for year in years]
+        result = pd.concat(tables, axis=1, join='inner')
+        if codes is not None:
+            result = result.reindex([code for code in codes if code in result.index])
+        return result
+
+    def __GetTextLengths(self, table: pd.DataFrame, section: str, year: int) -> np.ndarray:
+        repository = self.repositories[year]
+        doc_ids = table[CompanyInformationQuery.GetColumnName('doc_id', year)]
+        return np.fromiter((repository.GetTextLength(doc_id, section) for doc_id in doc_ids), dtype=np.int64, count=len(doc_ids))
+
+    # 前年度と当年度の数値がそろい、必要な本文が空でない会社を返す
+    # required_sections: 年度 => セクション名のリスト(タプルはいずれか1つが空でなければよい)
+    def GetEligible(self, target_year: int, codes: List[int] = None,
+                    required_sections: Dict[int, List[Union[str, tuple]]] = None) -> pd.DataFrame:
+        table = self.GetTable([target_year - 1, target_year], codes)
+
+        # 数値の欠損を除き、前年差を列として追加
+        valid = np.ones(len(table), dtype=bool)
+        for name in CompanyInformationQuery.CHECK_COLUMNS:
+            for year in [target_year - 1, target_year]:
+                valid &= table[CompanyInformationQuery.GetColumnName(name, year)].notna().to_numpy()
+        table = table[valid]
+        for name in CompanyInformationQuery.CHECK_COLUMNS:
+            table = table.assign(**{name + '_diff': table[CompanyInformationQuery.GetColumnName(name, target_year)]
+                                    - table[CompanyInformationQuery.GetColumnName(name, target_year - 1)]})
+
+        # 本文の長さは数値で絞り込んだ後の会社だけ調べる
+        for year, sections in (required_sections or {}).items():
+            for sections_or in sections:
+                if isinstance(sections_or, str):
+                    sections_or = (sections_or,)
+                valid = np.zeros(len(table), dtype=bool)
+                for section in sections_or:
+                    column = CompanyInformationQuery.GetColumnName(section + '_length', year)
+                    if column not in table:
+                        table = table.assign(**{column: self.__GetTextLengths(table, section, year)})
+                    valid |= table[column].to_numpy() > 0
+                table = table[valid]
+        return table
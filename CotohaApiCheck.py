@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+import os
+import io
+import sys
+import time
+import contextlib
+import urllib.parse
+import concurrent.futures
+
+from cotoha_api_python3 import CotohaApi
+from cotoha_api_python3 import CotohaApiError
+from cotoha_api_python3 import RetryPolicy
+from FakeCotohaServer import FakeCotohaServer
+from FakeCotohaServer import LatencyDistribution
+
+
+def PrintResult(name: str, ok: bool, detail: str) -> bool:
+    print('{0} {1}: {2}'.format('OK' if ok else 'NG', name, detail))
+    return ok
+
+
+# 順番に呼んでも並行に呼んでも、プールの大きさを超えて接続を張らない
+def CheckConnectionReuse() -> bool:
+    with FakeCotohaServer() as server:
+        cotoha_api = CotohaApi('check', 'check', server.base_url, server.token_url, pool_size=4)
+        for index in range(20):
+            cotoha_api.sentiment('売上が増加した{0}'.format(index))
+        sequential = PrintResult('connection reuse (sequential)',
+                                 cotoha_api.connection_pool.created_connections == 1 and server.connection_count == 1,
+                                 'token + 20 calls on {0} connection(s), server accepted {1}'.format(
+                                     cotoha_api.connection_pool.created_connections, server.connection_count))
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda index: cotoha_api.sentiment('利益が減少した{0}'.format(index)), range(40)))
+        created = cotoha_api.connection_pool.created_connections
+        concurrent_ok = PrintResult('connection reuse (4 threads)', created <= 4 and server.connection_count == created,
+                                    '40 more calls, {0} connection(s) in total, server accepted {1}'.format(created, server.connection_count))
+        cotoha_api.close()
+    return sequential and concurrent_ok
+
+
+# http_proxyを向けると、トークンもAPIもプロキシ(ここではFakeCotohaServer自身)へ絶対URLで送る
+def CheckHttpProxy() -> bool:
+    with FakeCotohaServer() as server:
+        os.environ['http_proxy'] = 'http://check:check@' + urllib.parse.urlsplit(server.base_url).netloc
+        try:
+            # 名前解決できないホストなので、直接つなごうとすれば失敗する
+            cotoha_api = CotohaApi('check', 'check', 'http://cotoha.invalid' + FakeCotohaServer.API_PATH,
+                                   'http://cotoha.invalid' + FakeCotohaServer.TOKEN_PATH)
+            for index in range(5):
+                cotoha_api.sentiment('売上が増加した{0}'.format(index))
+        finally:
+            del os.environ['http_proxy']
+        ok = PrintResult('http proxy', server.proxied_count == 6 and server.connection_count == 1,
+                         'token + 5 calls sent through the proxy {0} time(s) on {1} connection(s)'.format(
+                             server.proxied_count, server.connection_count))
+        cotoha_api.close()
+    return ok
+
+
+# 有効期間2秒のトークンを、期限切れ(401)になる前に取り直す
+def CheckTokenRenewal() -> bool:
+    with FakeCotohaServer(token_lifetime=2) as server:
+        cotoha_api = CotohaApi('check', 'check', server.base_url, server.token_url)
+        start = time.monotonic()
+        index = 0
+        while time.monotonic() - start < 5:
+            cotoha_api.sentiment('売上が増加した{0}'.format(index))
+            index += 1
+            time.sleep(0.05)
+        unauthorized = server.request_counts.get('v1/sentiment', {}).get(401, 0)
+        publish_count = cotoha_api.token_manager.publish_count
+        ok = PrintResult('token renewal', unauthorized == 0 and publish_count >= 3,
+                         '{0} calls over 5s with a 2s token: {1} publishes, {2} 401s'.format(index, publish_count, unauthorized))
+        cotoha_api.close()
+    return ok
+
+
+# トークンが無効になった直後に並行して401を受けても、取り直すのは1回だけ
+def CheckConcurrentUnauthorized() -> bool:
+    # 全スレッドが古いトークンで送り終えてから401が返るよう、応答を遅らせる
+    with FakeCotohaServer(latency=LatencyDistribution('constant', 0.1)) as server:
+        cotoha_api = CotohaApi('check', 'check', server.base_url, server.token_url, pool_size=16)
+        cotoha_api.sentiment('売上が増加した')
+        server.RevokeTokens()
+        # 401の度に出る表示は捨てる
+        with contextlib.redirect_stdout(io.StringIO()), concurrent.futures.ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(lambda index: cotoha_api.sentiment('利益が減少した{0}'.format(index)), range(16)))
+        unauthorized = server.request_counts.get('v1/sentiment', {}).get(401, 0)
+        publish_count = cotoha_api.token_manager.publish_count - 1
+        ok = PrintResult('one publish under concurrent 401s',
+                         publish_count == 1 and unauthorized == 16 and all(result['status'] == 0 for result in results),
+                         '16 threads got {0} 401s and published {1} new token(s)'.format(unauthorized, publish_count))
+        cotoha_api.close()
+    return ok
+
+
+# トークン発行の一時的な失敗はリトライし、回復しなければCotohaApiErrorにする
+def CheckTokenRetry() -> bool:
+    retry_policy = RetryPolicy(3, 0.01, 0.05)
+    with FakeCotohaServer(token_failures=2) as server:
+        cotoha_api = CotohaApi('check', 'check', server.base_url, server.token_url, retry_policy=retry_policy)
+        cotoha_api.sentiment('売上が増加した')
+        recovered = PrintResult('token retry', server.request_counts['token'] == {503: 2, 201: 1},
+                                'token endpoint answered {0}'.format(server.request_counts['token']))
+        cotoha_api.close()
+
+    with FakeCotohaServer(token_failures=3) as server:
+        cotoha_api = CotohaApi('check', 'check', server.base_url, server.token_url, retry_policy=retry_policy)
+        try:
+            cotoha_api.sentiment('売上が増加した')
+            error = None
+        except CotohaApiError as e:
+            error = e
+        cotoha_api.close()
+        failed = PrintResult('token retry exhausted', error is not None and error.endpoint == 'token' and error.status == 503,
+                             'raised {0!r}'.format(error))
+    return recovered and failed
+
+
+# 動作確認: FakeCotohaServerを相手にCotohaApiを動かし、接続の使い回し、プロキシ経由の送信、トークンの更新を確かめる
+# python CotohaApiCheck.py (失敗があれば終了コード1)
+if __name__ == '__main__':
+    # 手元の環境のプロキシ設定は使わない(確認で使うものは各確認の中で設定する)
+    for name in ['http_proxy', 'https_proxy', 'no_proxy', 'HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY']:
+        os.environ.pop(name, None)
+
+    results = [CheckConnectionReuse(), CheckHttpProxy(), CheckTokenRenewal(), CheckConcurrentUnauthorized(), CheckTokenRetry()]
+    if not all(results):
+        sys.exit(1)
@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import glob
+import json
+import mmap
+import struct
+from typing import Dict, Tuple
+
+
+# docs/配下の小さな.txtを1ファイルにまとめたアーカイブ
+# [本文(UTF-8)を連結したもの][索引JSON][索引の開始位置(8byte)][MAGIC(8byte)]
+class DocumentArchive:
+    MAGIC = b'COARIJPK'
+    FOOTER = struct.Struct('<Q8s')
+    FILE_NAME = 'docs.pack'
+
+    def __init__(self, archive_path: str):
+        super().__init__()
+
+        self.archive_path = archive_path
+        self.__file = open(archive_path, mode='rb')
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__mmap)
+
+        index_offset, magic = DocumentArchive.FOOTER.unpack_from(self.__mmap, len(self.__mmap) - DocumentArchive.FOOTER.size)
+        if magic != DocumentArchive.MAGIC:
+            raise Exception('DocumentArchive()', archive_path + ' is not a document archive')
+        index_bytes = self.__view[index_offset:len(self.__mmap) - DocumentArchive.FOOTER.size]
+        self.__index: Dict[str, Tuple[int, int]] = json.loads(str(index_bytes, 'UTF-8'))
+
+    @staticmethod
+    def GetKey(doc_id: str, section: str) -> str:
+        return doc_id + '/' + section
+
+    # 該当する本文がなければNone
+    def Get(self, doc_id: str, section: str) -> str:
+        key = DocumentArchive.GetKey(doc_id, section)
+        if key not in self.__index:
+            return None
+        offset, length = self.__index[key]
+        # mmapのスライスをコピーせずにデコード
+        return str(self.__view[offset:offset + length], 'UTF-8')
+
+    # 本文をデコードせずにバイト長だけ返す(該当する本文がなければNone)
+    def GetLength(self, doc_id: str, section: str) -> int:
+        key = DocumentArchive.GetKey(doc_id, section)
+        if key not in self.__index:
+            return None
+        return self.__index[key][1]
+
+    def close(self) -> None:
+        self.__view.release()
+        self.__mmap.close()
+        self.__file.close()
+
+    # docs/<doc_id>_<section>.txt をまとめて archive_path へ書き出す
+    @staticmethod
+    def Pack(docs_directory_path: str, archive_path: str) -> int:
+        index: Dict[str, Tuple[int, int]] = {}
+        temporary_path = archive_path + '.tmp'
+        with open(temporary_path, mode='wb') as archive:
+            offset = 0
+            for path in sorted(glob.glob(os.path.join(docs_directory_path, '*.txt'))):
+                doc_id, section = os.path.splitext(os.path.basename(path))[0].split('_', 1)
+                # 従来の読み込みと同じく改行を正規化した本文を格納
+                with open(path, mode='r', encoding='UTF-8') as f:
+                    data = f.read().encode('UTF-8')
+                archive.write(data)
+                index[DocumentArchive.GetKey(doc_id, section)] = (offset, len(data))
+                offset += len(data)
+            archive.write(json.dumps(index, ensure_ascii=False).encode('UTF-8'))
+            archive.write(DocumentArchive.FOOTER.pack(offset, DocumentArchive.MAGIC))
+        os.replace(temporary_path, archive_path)
+        return len(index)
+
+
+if __name__ == '__main__':
+    # python DocumentArchive.py [年 ...]  (省略時はdata/interim配下の全年度)
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    years = sys.argv[1:] if len(sys.argv) > 1 else sorted(os.listdir(os.path.join(data_directory, 'interim')))
+    for year in years:
+        docs_directory = os.path.join(data_directory, 'interim', str(year), 'docs')
+        if not os.path.isdir(docs_directory):
+            continue
+        count = DocumentArchive.Pack(docs_directory, os.path.join(data_directory, 'interim', str(year), DocumentArchive.FILE_NAME))
+        print('{0}: packed {1} files'.format(year, count))
@@ -0,0 +1,395 @@
+# -*- coding:utf-8 -*-
+import re
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Dict, List
+
+
+# 応答までの待ち時間の分布(秒)
+# constant:秒 / uniform:最小:最大 / lognormal:中央値:シグマ / pareto:最小:形状 (裾の重い分布)
+class LatencyDistribution:
+    KINDS = ['constant', 'uniform', 'lognormal', 'pareto']
+
+    def __init__(self, kind: str = 'constant', a: float = 0.0, b: float = 0.0):
+        super().__init__()
+
+        if kind not in LatencyDistribution.KINDS:
+            raise Exception('LatencyDistribution()', 'unknown distribution: ' + kind)
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    # 'lognormal:0.05:0.5' の形式から生成
+    @staticmethod
+    def Parse(text: str) -> 'LatencyDistribution':
+        values = text.split(':')
+        parameters = [float(value) for value in values[1:]] + [0.0, 0.0]
+        return LatencyDistribution(values[0], parameters[0], parameters[1])
+
+    def Sample(self, rng: random.Random) -> float:
+        if self.kind == 'uniform':
+            return rng.uniform(self.a, self.b)
+        if self.kind == 'lognormal':
+            return self.a * math.exp(rng.gauss(0, self.b)) if self.a > 0 else 0.0
+        if self.kind == 'pareto':
+            return self.a * rng.paretovariate(self.b) if self.b > 0 else self.a
+        return self.a
+
+
+# COTOHA APIの代わりにローカルで応答するサーバー(負荷試験や通信なしでの動作確認用)
+# 応答は入力から決まる(同じ入力なら同じ結果)。待ち時間、401/429/5xxの注入、レート制限を設定できる
+# 絶対URLのリクエストも受け付けるので、http_proxyに指定してプロキシ経由の確認にも使える
+class FakeCotohaServer:
+    TOKEN_PATH = '/v1/oauth/accesstokens'
+    API_PATH = '/nlp/'
+    ENDPOINTS = ['v1/ne', 'v1/similarity', 'v1/sentiment', 'v1/user_attribute', 'beta/user_attribute', 'beta/summary']  # user_attributeはbeta版も受け付ける
+    FAULT_STATUSES = [401, 429, 500, 502, 503]
+
+    POSITIVE_WORDS = ['増加', '増収', '増益', '向上', '改善', '好調', '拡大', '成長', '回復', '上昇']
+    NEGATIVE_WORDS = ['減少', '減収', '減益', '悪化', '低下', '低迷', '縮小', '損失', '下落', '懸念']
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: LatencyDistribution = None,
+                 endpoint_latencies: Dict[str, LatencyDistribution] = None, fault_rates: Dict[int, float] = None,
+                 requests_per_second: float = 0, burst_size: int = 1, token_lifetime: float = 86400, retry_after: float = 1, seed: int = 0,
+                 token_failures: int = 0):
+        super().__init__()
+
+        self.latency = latency if latency is not None else LatencyDistribution()
+        self.endpoint_latencies = endpoint_latencies if endpoint_latencies is not None else {}  # エンドポイント => 分布
+        self.fault_rates = fault_rates if fault_rates is not None else {}  # ステータス => 割合(0-1)
+        for status in self.fault_rates:
+            if status not in FakeCotohaServer.FAULT_STATUSES:
+                raise Exception('FakeCotohaServer()', 'unsupported fault status: ' + str(status))
+        self.requests_per_second = requests_per_second  # 0なら制限なし(超えたら429)
+        self.burst_size = burst_size
+        self.token_lifetime = token_lifetime  # これより古いトークンは401
+        self.retry_after = retry_after  # 429のRetry-After(秒)
+        self.token_failures = token_failures  # 残りこの回数のトークン発行は503にする
+
+        self.request_counts: Dict[str, Dict[int, int]] = {}  # エンドポイント => ステータス => 回数
+        self.connection_count = 0  # 受け付けた接続数(keep-aliveで使い回されているかの確認用)
+        self.proxied_count = 0  # 絶対URLで届いたリクエスト数(プロキシとして使われた回数)
+        self.__rng = random.Random(seed)
+        self.__tokens: Dict[str, float] = {}  # 発行したトークン => 発行時刻
+        self.__bucket = float(burst_size)
+        self.__bucket_updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+        self.__server = ThreadingHTTPServer((host, port), FakeCotohaServer.__Handler)
+        self.__server.daemon_threads = True
+        self.__server.fake = self
+        self.__thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return 'http://{0}:{1}{2}'.format(host, port, FakeCotohaServer.API_PATH)
+
+    @property
+    def token_url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return 'http://{0}:{1}{2}'.format(host, port, FakeCotohaServer.TOKEN_PATH)
+
+    # 別スレッドで応答を始める
+    def Start(self) -> 'FakeCotohaServer':
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self.__server.serve_forever()
+
+    def close(self) -> None:
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+
+    def __enter__(self) -> 'FakeCotohaServer':
+        return self.Start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __Count(self, endpoint: str, status: int) -> None:
+        with self.__lock:
+            counts = self.request_counts.setdefault(endpoint, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def __Random(self) -> float:
+        with self.__lock:
+            return self.__rng.random()
+
+    def __GetLatency(self, endpoint: str) -> float:
+        distribution = self.endpoint_latencies.get(endpoint, self.latency)
+        with self.__lock:
+            return max(0.0, distribution.Sample(self.__rng))
+
+    # トークンバケット(空なら429)
+    def __TryAcquire(self) -> bool:
+        if self.requests_per_second <= 0:
+            return True
+        with self.__lock:
+            now = time.monotonic()
+            self.__bucket = min(float(self.burst_size), self.__bucket + (now - self.__bucket_updated) * self.requests_per_second)
+            self.__bucket_updated = now
+            if self.__bucket < 1:
+                return False
+            self.__bucket -= 1
+            return True
+
+    def __PublishToken(self) -> dict:
+        with self.__lock:
+            access_token = hashlib.sha256('{0}:{1}'.format(len(self.__tokens), time.time()).encode()).hexdigest()[:28]
+            self.__tokens[access_token] = time.monotonic()
+        return {'access_token': access_token, 'token_type': 'bearer', 'expires_in': str(int(self.token_lifetime)),
+                'scope': '', 'issued_at': str(int(time.time() * 1000))}
+
+    # 発行済みのトークンをすべて無効にする(以降のAPI呼び出しは新しいトークンを取るまで401)
+    def RevokeTokens(self) -> None:
+        with self.__lock:
+            self.__tokens = {}
+
+    def __TakeTokenFailure(self) -> bool:
+        with self.__lock:
+            if self.token_failures <= 0:
+                return False
+            self.token_failures -= 1
+            return True
+
+    def __IsValidToken(self, authorization: str) -> bool:
+        if authorization is None or not authorization.startswith('Bearer '):
+            return False
+        with self.__lock:
+            issued_at = self.__tokens.get(authorization[len('Bearer '):])
+        return issued_at is not None and time.monotonic() - issued_at < self.token_lifetime
+
+    # 文字列から決まる0-1の値(同じ入力なら同じ結果にするため乱数の代わりに使う)
+    @staticmethod
+    def GetHashValue(text: str) -> float:
+        return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'big') / float(1 << 64)
+
+    @staticmethod
+    def GetNe(sentence: str) -> List[dict]:
+        result = []
+        for match in re.finditer(r'[ァ-ヴー]{2,}|[0-9０-９]+年', sentence):
+            word_class = 'DAT' if match.group().endswith('年') else 'ART'
+            result.append({'begin_pos': match.start(), 'end_pos': match.end(), 'form': match.group(), 'std_form': match.group(),
+                           'class': word_class, 'extended_class': '', 'source': 'basic'})
+        return result[:50]
+
+    # 文字2-gramの重なり(Dice係数)
+    @staticmethod
+    def GetSimilarity(s1: str, s2: str) -> float:
+        if s1 == s2:
+            return 1.0
+        bigrams1 = {s1[index:index + 2] for index in range(len(s1) - 1)}
+        bigrams2 = {s2[index:index + 2] for index in range(len(s2) - 1)}
+        if len(bigrams1) + len(bigrams2) == 0:
+            return 0.0
+        return 2.0 * len(bigrams1 & bigrams2) / (len(bigrams1) + len(bigrams2))
+
+    @staticmethod
+    def GetSentiment(sentence: str) -> dict:
+        positive = sum(sentence.count(word) for word in FakeCotohaServer.POSITIVE_WORDS)
+        negative = sum(sentence.count(word) for word in FakeCotohaServer.NEGATIVE_WORDS)
+        sentiment = 'Positive' if positive > negative else 'Negative' if negative > positive else 'Neutral'
+        score = 0.1 + 0.8 * FakeCotohaServer.GetHashValue(sentence)
+        return {'sentiment': sentiment, 'score': score, 'emotional_phrase': []}
+
+    @staticmethod
+    def GetUserAttribute(document: str) -> dict:
+        value = FakeCotohaServer.GetHashValue(document)
+        return {'age': ['20-29歳', '30-39歳', '40-49歳', '50-59歳'][int(value * 4)],
+                'civilstatus': '既婚' if value < 0.5 else '未婚',
+                'hobby': [['INTERNET', 'COOKING'], ['TRAVEL'], ['READING', 'MUSIC']][int(value * 3)],
+                'location': ['関東', '近畿', '中部', '九州'][int(value * 4)],
+                'occupation': ['会社員', '自営業', '公務員'][int(value * 3)]}
+
+    # 先頭からsent_len文(抽出型の要約のつもり)
+    @staticmethod
+    def GetSummary(document: str, sent_len: float) -> str:
+        sentences = [sentence + '。' for sentence in document.split('。') if len(sentence.strip()) > 0]
+        return '\n'.join(sentences[:max(1, int(sent_len))])
+
+    def GetResult(self, endpoint: str, body: dict):
+        if endpoint == 'v1/ne':
+            return FakeCotohaServer.GetNe(body['sentence'])
+        if endpoint == 'v1/similarity':
+            return {'score': FakeCotohaServer.GetSimilarity(body['s1'], body['s2'])}
+        if endpoint == 'v1/sentiment':
+            return FakeCotohaServer.GetSentiment(body['sentence'])
+        if endpoint.endswith('/user_attribute'):
+            return FakeCotohaServer.GetUserAttribute(body['document'])
+        return FakeCotohaServer.GetSummary(body['document'], body.get('sent_len', 1))
+
+    # 1リクエスト分の処理(ステータス, 本文, 追加ヘッダ)
+    def Handle(self, path: str, headers, body: dict) -> (int, dict, Dict[str, str]):
+        if path == FakeCotohaServer.TOKEN_PATH:
+            if self.__TakeTokenFailure():
+                self.__Count('token', 503)
+                return 503, {'message': 'injected', 'status': 503}, {}
+            self.__Count('token', 201)
+            return 201, self.__PublishToken(), {}
+        if not path.startswith(FakeCotohaServer.API_PATH) or path[len(FakeCotohaServer.API_PATH):] not in FakeCotohaServer.ENDPOINTS:
+            self.__Count(path, 404)
+            return 404, {'message': 'not found'}, {}
+        endpoint = path[len(FakeCotohaServer.API_PATH):]
+
+        time.sleep(self.__GetLatency(endpoint))
+        status = 200
+        extra_headers: Dict[str, str] = {}
+        if not self.__IsValidToken(headers.get('Authorization')):
+            status = 401
+        elif not self.__TryAcquire():
+            status = 429
+        else:
+            # 割合に従って障害を注入
+            value = self.__Random()
+            for fault_status, rate in sorted(self.fault_rates.items()):
+                if value < rate:
+                    status = fault_status
+                    break
+                value -= rate
+        self.__Count(endpoint, status)
+
+        if status == 429:
+            extra_headers['Retry-After'] = '{0:g}'.format(self.retry_after)
+        if status != 200:
+            return status, {'message': 'injected' if status != 401 else 'Unauthorized', 'status': status}, extra_headers
+        try:
+            return 200, {'result': self.GetResult(endpoint, body), 'status': 0, 'message': 'OK'}, extra_headers
+        except (KeyError, TypeError, AttributeError) as e:
+            return 400, {'message': 'bad request: ' + str(e), 'status': 400}, extra_headers
+
+    # 接続の受け付けと、プロキシとして受けたリクエストを数える(ハンドラから呼ぶ)
+    def AddConnection(self) -> None:
+        with self.__lock:
+            self.connection_count += 1
+
+    def AddProxied(self) -> None:
+        with self.__lock:
+            self.proxied_count += 1
+
+    # ステータスごとの回数を表示
+    def PrintStats(self) -> None:
+        with self.__lock:
+            counts = {endpoint: dict(statuses) for endpoint, statuses in self.request_counts.items()}
+        for endpoint, statuses in sorted(counts.items()):
+            print('{0:>17}: {1}'.format(endpoint, ', '.join('{0}={1}'.format(status, count) for status, count in sorted(statuses.items()))))
+
+    class __Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-aliveで接続を使い回せるようにする
+        disable_nagle_algorithm = True  # ヘッダと本文を別々に書くので、遅延ACKとの組み合わせで40ms待たないようにする
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def setup(self) -> None:
+            super().setup()
+            self.server.fake.AddConnection()
+
+        def do_POST(self) -> None:
+            target = urllib.parse.urlsplit(self.path)
+            if len(target.scheme) > 0:
+                self.server.fake.AddProxied()
+            length = int(self.headers.get('Content-Length', 0))
+            data = self.rfile.read(length)
+            try:
+                body = json.loads(data) if length > 0 else {}
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                status, result, extra_headers = 400, {'message': 'invalid json'}, {}
+            else:
+                status, result, extra_headers = self.server.fake.Handle(target.path, self.headers, body)
+
+            res_body = json.dumps(result, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json;charset=UTF-8')
+            self.send_header('Content-Length', str(len(res_body)))
+            for name, value in extra_headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(res_body)
+
+
+# ステータス=割合 をカンマ区切りで ('429=0.02,503=0.01')
+def ParseFaultRates(text: str) -> Dict[int, float]:
+    fault_rates: Dict[int, float] = {}
+    for item in text.split(','):
+        if len(item.strip()) == 0:
+            continue
+        status, rate = item.split('=')
+        fault_rates[int(status)] = float(rate)
+    return fault_rates
+
+
+# エンドポイント=分布 をカンマ区切りで ('beta/summary=lognormal:0.3:0.5')
+def ParseEndpointLatencies(text: str) -> Dict[str, LatencyDistribution]:
+    endpoint_latencies: Dict[str, LatencyDistribution] = {}
+    for item in text.split(','):
+        if len(item.strip()) == 0:
+            continue
+        endpoint, distribution = item.split('=')
+        endpoint_latencies[endpoint] = LatencyDistribution.Parse(distribution)
+    return endpoint_latencies
+
+
+# FakeCotohaServerとLoadTestで共通の引数
+def AddServerArguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--latency', default='constant:0',
+                        help='response latency: constant:SEC, uniform:MIN:MAX, lognormal:MEDIAN:SIGMA or pareto:MIN:SHAPE')
+    parser.add_argument('--endpoint-latency', default='',
+                        help='per-endpoint latency, e.g. beta/summary=lognormal:0.3:0.5,v1/ne=constant:0.05')
+    parser.add_argument('--faults', default='',
+                        help='injected error rates by status, e.g. 401=0.01,429=0.02,503=0.01')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='server-side requests per second (429 when exceeded, 0: unlimited)')
+    parser.add_argument('--burst', type=int, default=1,
+                        help='server-side burst size for --rate-limit')
+    parser.add_argument('--token-lifetime', type=float, default=86400,
+                        help='seconds before an access token is rejected with 401')
+    parser.add_argument('--retry-after', type=float, default=1,
+                        help='Retry-After seconds sent with 429')
+    parser.add_argument('--token-failures', type=int, default=0,
+                        help='answer this many token requests with 503 before publishing tokens')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for latency and fault injection')
+
+
+def CreateServer(args: argparse.Namespace, host: str = '127.0.0.1', port: int = 0) -> FakeCotohaServer:
+    return FakeCotohaServer(host, port, LatencyDistribution.Parse(args.latency), ParseEndpointLatencies(args.endpoint_latency),
+                            ParseFaultRates(args.faults), args.rate_limit, args.burst, args.token_lifetime, args.retry_after, args.seed,
+                            args.token_failures)
+
+
+if __name__ == '__main__':
+    # 単独で起動: python FakeCotohaServer.py [--port 18080] [--latency lognormal:0.05:0.5] [--faults 429=0.02]
+    # config.iniのDeveloper API Base URL / Access Token Publish URLを表示されたURLに向ければmain.pyなどから使える
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    AddServerArguments(parser)
+    args = parser.parse_args()
+
+    server = CreateServer(args, args.host, args.port)
+    print('Developer API Base URL: ' + server.base_url)
+    print('Access Token Publish URL: ' + server.token_url)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.PrintStats()
+    server.close()
@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import configparser
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import main
+from TopixCore30 import TopixCore30
+from Nikkei255 import Nikkei255
+from AllCompanies import AllCompanies
+from CompanyInformation import CompanyInformation
+from CompanyInformation import CompanyInformationRepository
+from CompanyInformationQuery import CompanyInformationQuery
+from cotoha_api_python3 import AsyncCotohaApi
+from BatchJournal import BatchJournal
+from ReportWriter import ReportWriter
+from ReportWriter import OrderedReportWriter
+from FakeCotohaServer import AddServerArguments
+from FakeCotohaServer import CreateServer
+
+
+# 負荷試験: FakeCotohaServerを立て、main.pyと同じ処理(AnalyzeCompanies)を流して、処理量と応答時間の分布を表示する
+# python LoadTest.py [companies] [--latency lognormal:0.05:0.5] [--faults 429=0.02,503=0.01] [--rate-limit 20]
+# レポートは捨て、ジャーナルとconfig.iniは一時ディレクトリに作る(本番のキャッシュやジャーナルには触れない)
+if __name__ == '__main__':
+    APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + '/'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('companies', nargs='?', type=int, default=0,
+                        help='number of companies to analyze (0: every eligible company)')
+    parser.add_argument('--universe', default='nikkei255', choices=['nikkei255', 'topixcore30', 'all'],
+                        help='target companies')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Max Concurrency of the client (default: config.ini)')
+    parser.add_argument('--client-rate-limit', type=float, default=0,
+                        help='client-side Requests Per Second (0: unlimited)')
+    AddServerArguments(parser)
+    args = parser.parse_args()
+
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    cir = {year: CompanyInformationRepository(data_directory, year) for year in [main.TARGET_YEAR - 1, main.TARGET_YEAR]}
+    if args.universe == 'all':
+        codes = AllCompanies.Get(cir[main.TARGET_YEAR])
+    elif args.universe == 'topixcore30':
+        codes = TopixCore30.Get()
+    else:
+        codes = Nikkei255.Get()
+    eligible = CompanyInformationQuery(cir).GetEligible(main.TARGET_YEAR, [code * 10 for code in codes], {
+        main.TARGET_YEAR - 1: ['business_policy_environment_issue_etc', 'business_risks'],
+        main.TARGET_YEAR: ['business_policy_environment_issue_etc', 'business_risks',
+                           ('business_analysis_of_finance', 'business_management_analysis'),
+                           'business_research_and_development']})
+    five_digit_codes: List[int] = [int(five_digit_code) for five_digit_code in eligible.index]
+    if args.companies > 0:
+        five_digit_codes = five_digit_codes[:args.companies]
+    if len(five_digit_codes) == 0:
+        print('no documents under ' + data_directory)
+        sys.exit(1)
+
+    with CreateServer(args) as server, tempfile.TemporaryDirectory() as work_directory:
+        # config.iniの接続先だけを差し替える(レスポンスキャッシュは使わない)
+        config = configparser.ConfigParser()
+        config.read(APP_ROOT + 'config.ini')
+        config.set('COTOHA API', 'Developer API Base URL', server.base_url)
+        config.set('COTOHA API', 'Access Token Publish URL', server.token_url)
+        config.set('COTOHA API', 'Response Cache Path', '')
+        config.set('COTOHA API', 'Requests Per Second', str(args.client_rate_limit))
+        config.set('COTOHA API', 'Daily Request Limit', '0')
+        if args.concurrency is not None:
+            config.set('COTOHA API', 'Max Concurrency', str(args.concurrency))
+            config.set('COTOHA API', 'Connection Pool Size', str(args.concurrency))
+        config_path = os.path.join(work_directory, 'config.ini')
+        with open(config_path, mode='w', encoding='UTF-8') as f:
+            config.write(f)
+
+        main.cotoha_api = AsyncCotohaApi.FromConfig(config_path)
+        main.process_pool = ProcessPoolExecutor(main.PROCESS_POOL_SIZE, mp_context=multiprocessing.get_context('spawn')) if main.PROCESS_POOL_SIZE > 0 else None
+        journal = BatchJournal(os.path.join(work_directory, 'journal.jsonl'))
+        targets: Dict[int, Dict[int, CompanyInformation]] = {
+            five_digit_code: {year: cir[year].Get(five_digit_code) for year in [main.TARGET_YEAR - 1, main.TARGET_YEAR]}
+            for five_digit_code in five_digit_codes}
+
+        start = time.perf_counter()
+        with OrderedReportWriter(ReportWriter(os.devnull), five_digit_codes) as report:
+            asyncio.run(main.AnalyzeCompanies(targets, journal, report))
+        elapsed = time.perf_counter() - start
+        finished = report.writer.count
+        journal.close()
+
+        metrics = main.cotoha_api.cotoha_api.metrics
+        snapshot = metrics.GetSnapshot()
+        calls = sum(values['calls'] for values in snapshot.values())
+        sent = sum(values['sent'] for values in snapshot.values())
+        print('{0}/{1} companies in {2:.2f}s: {3:.2f} companies/s, {4:.1f} calls/s, {5:.1f} requests/s sent'.format(
+            finished, len(five_digit_codes), elapsed, finished / elapsed, calls / elapsed, sent / elapsed))
+        main.PrintMetrics(metrics)
+        print('server:')
+        server.PrintStats()
+
+        if main.process_pool is not None:
+            main.process_pool.shutdown()
+        main.cotoha_api.close()
@@ -0,0 +1,173 @@
+# -*- coding:utf-8 -*-
+import io
+import sys
+import gzip
+import json
+import html
+from typing import Dict, List, Tuple
+
+
+# 会社ごとのレポートを出来た順にファイル(または標準出力)へ書き出す
+# markdown/jsonl/html に対応し、ファイル名が.gzで終わればgzip圧縮する
+class ReportWriter:
+    FORMATS = ['markdown', 'jsonl', 'html']
+
+    def __init__(self, file_path: str = None, report_format: str = 'markdown', buffer_size: int = 1024 * 1024):
+        super().__init__()
+
+        if report_format not in ReportWriter.FORMATS:
+            raise Exception('ReportWriter()', 'unknown report format: ' + report_format)
+        self.file_path = file_path  # Noneなら標準出力
+        self.report_format = report_format
+        self.count = 0
+
+        if file_path is None:
+            self.__file = sys.stdout
+        elif file_path.endswith('.gz'):
+            self.__file = io.TextIOWrapper(io.BufferedWriter(gzip.open(file_path, mode='wb'), buffer_size), encoding='UTF-8')
+        else:
+            self.__file = open(file_path, mode='w', encoding='UTF-8', buffering=buffer_size)
+
+        if report_format == 'html':
+            self.__file.write('<!DOCTYPE html>\n<html>\n<head><meta charset="UTF-8"><title>CoARiJ and COTOHA</title></head>\n<body>\n')
+
+    def __enter__(self) -> 'ReportWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    # 利益率(売上が0なら求められないので'-')
+    @staticmethod
+    def __GetRate(income: float, net_sales: float) -> str:
+        if net_sales == 0:
+            return '-'
+        return '{0:.2f}%'.format(income / net_sales * 100)
+
+    @staticmethod
+    def __GetFigures(record: dict) -> List[str]:
+        year = record['year']
+        net_sales = record['net_sales']
+        operating_income = record['operating_income']
+        ordinary_income = record['ordinary_income']
+
+        return [
+            '総売上　: {0:>7.2f}億円({1}) => {2:>7.2f}億円({3})'.format(
+                net_sales[0] / 100000000, year - 1,
+                net_sales[1] / 100000000, year),
+            '営業利益: {0:>7.2f}億円({1}) => {2:>7.2f}億円({3}), 営業利益率{4}({5}) => {6}({7})'.format(
+                operating_income[0] / 100000000, year - 1,
+                operating_income[1] / 100000000, year,
+                ReportWriter.__GetRate(operating_income[0], net_sales[0]), year - 1,
+                ReportWriter.__GetRate(operating_income[1], net_sales[1]), year),
+            '経常利益: {0:>7.2f}億円({1}) => {2:>7.2f}億円({3}), 経常利益率{4}({5}) => {6}({7})'.format(
+                ordinary_income[0] / 100000000, year - 1,
+                ordinary_income[1] / 100000000, year,
+                ReportWriter.__GetRate(ordinary_income[0], net_sales[0]), year - 1,
+                ReportWriter.__GetRate(ordinary_income[1], net_sales[1]), year)]
+
+    # 見出しと(折りたたみのラベル, 本文)の組
+    @staticmethod
+    def __GetSections(record: dict) -> List[Tuple[str, List[Tuple[str, str]]]]:
+        sections: List[Tuple[str, List[Tuple[str, str]]]] = []
+
+        # 類似度が低い場合に要約を表示
+        if record['business_policy_environment_issue_etc_summary'] is not None:
+            sections.append(('経営方針、経営環境及び対処すべき課題等', [('要約', record['business_policy_environment_issue_etc_summary'])]))
+        if record['business_risks_summary'] is not None:
+            sections.append(('事業等のリスク', [('## 要約', record['business_risks_summary'])]))
+
+        # 感情分析
+        if record['contradicted']:
+            sections.append(('財政状態、経営成績及びキャッシュ・フローの状況の分析', [('原文', record['analysis_original'])]))
+        else:
+            sections.append(('財政状態、経営成績及びキャッシュ・フローの状況の分析', [('要約', record['analysis_summary'])]))
+
+        # 固有表現抽出
+        sections.append(('研究開発活動', [('キーワード', '{0}'.format(record['ne'])),
+                                         ('要約', record['research_and_development_summary'])]))
+        return sections
+
+    def __WriteMarkdown(self, record: dict) -> None:
+        write = self.__file.write
+        write('---\n')
+        write('### [{0}]\n'.format(record['name']))
+        for figure in ReportWriter.__GetFigures(record):
+            write(figure)
+            write('\n')
+        write('\n')
+        for title, details in ReportWriter.__GetSections(record):
+            write('#### {0}\n'.format(title))
+            for label, text in details:
+                write('<details><summary>{0}</summary><div>\n'.format(label))
+                write(str(text))
+                write('\n</div></details>\n')
+        write('---\n\n')
+
+    def __WriteHtml(self, record: dict) -> None:
+        write = self.__file.write
+        write('<section>\n<h3>{0}</h3>\n<p>{1}</p>\n'.format(
+            html.escape(record['name']), '<br>\n'.join(html.escape(figure) for figure in ReportWriter.__GetFigures(record))))
+        for title, details in ReportWriter.__GetSections(record):
+            write('<h4>{0}</h4>\n'.format(html.escape(title)))
+            for label, text in details:
+                write('<details><summary>{0}</summary><div style="white-space: pre-wrap">'.format(html.escape(label.lstrip('# '))))
+                write(html.escape(str(text)))
+                write('</div></details>\n')
+        write('</section>\n')
+
+    # 1社分を書き出し、途中で止まっても失われないようにすぐflushする
+    def Write(self, record: dict) -> None:
+        if self.report_format == 'jsonl':
+            self.__file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        elif self.report_format == 'html':
+            self.__WriteHtml(record)
+        else:
+            self.__WriteMarkdown(record)
+        self.__file.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        if self.__file is None:
+            return
+        if self.report_format == 'html':
+            self.__file.write('</body>\n</html>\n')
+        self.__file.flush()
+        if self.__file is not sys.stdout:
+            self.__file.close()
+        self.__file = None
+
+
+# 終わった順に届く記録を、指定した銘柄コード順に並べ直してReportWriterへ渡す
+# 前の会社がそろった時点で書き出すので、全社の完了を待たない
+class OrderedReportWriter:
+    def __init__(self, writer: ReportWriter, codes: List[int]):
+        super().__init__()
+
+        self.writer = writer
+        self.__codes = codes
+        self.__next_index = 0
+        self.__pending: Dict[int, dict] = {}  # code => 記録(失敗した会社はNone)
+
+    def __enter__(self) -> 'OrderedReportWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def Add(self, code: int, record: dict) -> None:
+        self.__pending[code] = record
+        while self.__next_index < len(self.__codes) and self.__codes[self.__next_index] in self.__pending:
+            record = self.__pending.pop(self.__codes[self.__next_index])
+            if record is not None:
+                self.writer.Write(record)
+            self.__next_index += 1
+
+    # 中断時などは、そろっていない会社を飛ばして残りを書き出す
+    def close(self) -> None:
+        for code in self.__codes[self.__next_index:]:
+            record = self.__pending.pop(code, None)
+            if record is not None:
+                self.writer.Write(record)
+        self.__next_index = len(self.__codes)
+        self.writer.close()
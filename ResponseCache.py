@@ -0,0 +1,79 @@
+# -*- coding:utf-8 -*-
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+# APIレスポンスのディスクキャッシュ(エンドポイント + リクエストボディのハッシュをキーとする)
+class ResponseCache:
+    def __init__(self, file_path: str, max_size: int = 512 * 1024 * 1024):
+        super().__init__()
+
+        directory = os.path.dirname(os.path.abspath(file_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.file_path = file_path
+        self.max_size = max_size  # bytes, 0なら無制限
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                  'key TEXT PRIMARY KEY, endpoint TEXT, body BLOB, size INTEGER, accessed REAL)')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.__connection.commit()
+        self.__total_size = self.__connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def GetKey(endpoint: str, data: bytes) -> str:
+        return hashlib.sha256(endpoint.encode() + b'\n' + data).hexdigest()
+
+    def Get(self, endpoint: str, data: bytes) -> bytes:
+        key = ResponseCache.GetKey(endpoint, data)
+        with self.__lock:
+            row = self.__connection.execute('SELECT body FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+            self.__connection.commit()
+            return bytes(row[0])
+
+    def Put(self, endpoint: str, data: bytes, body: bytes) -> None:
+        key = ResponseCache.GetKey(endpoint, data)
+        with self.__lock:
+            row = self.__connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.__total_size -= row[0]
+            self.__connection.execute('INSERT OR REPLACE INTO responses (key, endpoint, body, size, accessed) VALUES (?, ?, ?, ?, ?)',
+                                      (key, endpoint, sqlite3.Binary(body), len(body), time.time()))
+            self.__total_size += len(body)
+            self.__Evict()
+            self.__connection.commit()
+
+    # 上限サイズを超えたら参照の古いものから削除
+    def __Evict(self) -> None:
+        if self.max_size <= 0:
+            return
+        while self.__total_size > self.max_size:
+            rows = self.__connection.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 64').fetchall()
+            if len(rows) == 0:
+                self.__total_size = 0
+                return
+            for key, size in rows:
+                self.__connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.__total_size -= size
+                if self.__total_size <= self.max_size:
+                    return
+
+    def GetTotalSize(self) -> int:
+        return self.__total_size
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+import zlib
+import configparser
+from typing import Dict
+
+import numpy as np
+
+
+# ローカルで求めた類似度で、しきい値より明らかに上/下の文章はAPIを呼ばずに判定する
+# 文字n-gramの出現回数ベクトルのコサイン類似度(NumPyで計算)
+class SimilarityPrescreen:
+    def __init__(self, lower_bound: float, upper_bound: float, threshold: float = 0.8, ngram_size: int = 3, audit_rate: float = 0.0):
+        super().__init__()
+
+        self.lower_bound = lower_bound  # これ以下なら明らかに低い
+        self.upper_bound = upper_bound  # これ以上なら明らかに高い
+        self.threshold = threshold
+        self.ngram_size = ngram_size  # 1文字21bitで64bit整数に詰めるので3まで
+        if not 1 <= ngram_size <= 3:
+            raise Exception('SimilarityPrescreen()', 'ngram size must be 1 to 3: ' + str(ngram_size))
+        self.audit_rate = audit_rate  # ローカルで判定できたもののうち、確かめるためにAPIへも送る割合(0-1)
+        self.checked_count = 0
+        self.skipped_count = 0
+        self.compared_count = 0  # 上下限の間でAPIを呼んだもの
+        self.agreed_count = 0  # そのうちローカルの判定がAPIと一致したもの
+        self.audited_count = 0  # ローカルで判定できたが、監査のためAPIを呼んだもの
+        self.audit_agreed_count = 0  # そのうちローカルの判定がAPIと一致したもの(上下限が妥当かはこちらで見る)
+
+    # config.iniの[Similarity Prescreen]から生成(項目がなければNone = 使わない)
+    @staticmethod
+    def FromConfig(config_path: str, threshold: float = 0.8) -> 'SimilarityPrescreen':
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        if not config.has_section('Similarity Prescreen'):
+            return None
+        LOWER_BOUND = config.getfloat('Similarity Prescreen', 'Lower Bound', fallback=0)
+        UPPER_BOUND = config.getfloat('Similarity Prescreen', 'Upper Bound', fallback=1)
+        NGRAM_SIZE = config.getint('Similarity Prescreen', 'Ngram Size', fallback=3)
+        AUDIT_RATE = config.getfloat('Similarity Prescreen', 'Audit Rate', fallback=0)
+        return SimilarityPrescreen(LOWER_BOUND, UPPER_BOUND, threshold, NGRAM_SIZE, AUDIT_RATE)
+
+    # 文字n-gramを整数(1文字21bit)にして、種類ごとの出現回数を返す
+    @staticmethod
+    def GetNgramCounts(text: str, size: int) -> (np.ndarray, np.ndarray):
+        code_points = np.frombuffer(text.encode('UTF-32-LE'), dtype=np.uint32).astype(np.int64)
+        if len(code_points) < size:
+            return np.unique(code_points[:0], return_counts=True)
+        ngrams = np.zeros(len(code_points) - size + 1, dtype=np.int64)
+        for offset in range(size):
+            ngrams = (ngrams << 21) | code_points[offset:len(code_points) - size + 1 + offset]
+        return np.unique(ngrams, return_counts=True)
+
+    @staticmethod
+    def GetScore(text1: str, text2: str, size: int = 3) -> float:
+        ngrams1, counts1 = SimilarityPrescreen.GetNgramCounts(text1, size)
+        ngrams2, counts2 = SimilarityPrescreen.GetNgramCounts(text2, size)
+        if len(ngrams1) == 0 or len(ngrams2) == 0:
+            return 1.0 if text1 == text2 else 0.0
+        _, indices1, indices2 = np.intersect1d(ngrams1, ngrams2, assume_unique=True, return_indices=True)
+        dot = float(np.dot(counts1[indices1].astype(np.float64), counts2[indices2].astype(np.float64)))
+        return dot / (np.linalg.norm(counts1.astype(np.float64)) * np.linalg.norm(counts2.astype(np.float64)))
+
+    # 監査に回すか(文章から決まるので、実行し直しても同じものが選ばれ、レスポンスキャッシュが効く)
+    def IsAudited(self, text1: str, text2: str) -> bool:
+        if self.audit_rate <= 0:
+            return False
+        return zlib.crc32((text1 + '\n' + text2).encode()) < self.audit_rate * 2 ** 32
+
+    # ローカルの類似度と、APIを呼ばずに判定してよいか、監査のためAPIへも送るかを返す
+    def Screen(self, text1: str, text2: str) -> (float, bool, bool):
+        score = SimilarityPrescreen.GetScore(text1, text2, self.ngram_size)
+        self.checked_count += 1
+        decided = score >= self.upper_bound or score <= self.lower_bound
+        audited = decided and self.IsAudited(text1, text2)
+        if decided and not audited:
+            self.skipped_count += 1
+        return score, decided, audited
+
+    # APIを呼んだ場合に、ローカルの判定と一致したかを記録
+    def AddApiScore(self, local_score: float, api_score: float, audited: bool = False) -> None:
+        agreed = (local_score < self.threshold) == (api_score < self.threshold)
+        if audited:
+            self.audited_count += 1
+            self.audit_agreed_count += int(agreed)
+        else:
+            self.compared_count += 1
+            self.agreed_count += int(agreed)
+
+    def GetStats(self) -> Dict[str, int]:
+        return {'prescreen_checked': self.checked_count, 'prescreen_skipped': self.skipped_count,
+                'prescreen_compared': self.compared_count, 'prescreen_agreed': self.agreed_count,
+                'prescreen_audited': self.audited_count, 'prescreen_audit_agreed': self.audit_agreed_count}
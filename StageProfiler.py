@@ -0,0 +1,139 @@
+# -*- coding:utf-8 -*-
+import os
+import json
+import time
+import cProfile
+import threading
+import contextlib
+import contextvars
+import tracemalloc
+from typing import Dict, List
+
+
+# 処理段階(読み込み/絞り込み/分割/API/集計/出力)ごとの時間とメモリを、会社ごとと実行全体で集計する
+# 有効にしない限り何もしない
+class StageProfiler:
+    STAGES = ['load', 'filter', 'chunk', 'api', 'aggregate', 'render']
+    FIELDS = ['count', 'wall', 'cpu', 'memory']  # 回数, 経過秒, CPU秒(そのスレッドのみ), 確保したままのバイト数(tracemalloc)
+
+    # 処理中の会社(asyncioのタスクごとに別の値になる)
+    current_company: contextvars.ContextVar = contextvars.ContextVar('current_company', default=None)
+
+    def __init__(self):
+        super().__init__()
+
+        self.enabled = False
+        self.trace_memory = False
+        self.cprofile_stage = None  # この段階だけcProfileを取る
+        self.__records: Dict[int, Dict[str, List[float]]] = {}  # 会社(全体の処理はNone) => 段階 => FIELDSの値
+        self.__lock = threading.Lock()
+        self.__profile = None
+        self.__profile_depth = 0
+        self.__start_wall = 0.0
+        self.__start_cpu = 0.0
+
+    def Enable(self, trace_memory: bool = False, cprofile_stage: str = None) -> None:
+        if cprofile_stage is not None and cprofile_stage not in StageProfiler.STAGES:
+            raise Exception('StageProfiler.Enable()', 'unknown stage: ' + cprofile_stage)
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.cprofile_stage = cprofile_stage
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if cprofile_stage is not None:
+            self.__profile = cProfile.Profile()
+        self.__start_wall = time.perf_counter()
+        self.__start_cpu = time.process_time()
+
+    @staticmethod
+    def SetCompany(company: int) -> None:
+        StageProfiler.current_company.set(company)
+
+    # with profiler.Measure('chunk'): ...
+    # awaitを挟む段階はその間に他の会社の処理が進むので、経過時間は待ち時間を含み、CPU時間は記録しない(waits=True)
+    @contextlib.contextmanager
+    def Measure(self, stage: str, company: int = None, waits: bool = False):
+        if not self.enabled:
+            yield
+            return
+
+        if company is None:
+            company = StageProfiler.current_company.get()
+        profiling = self.__profile is not None and stage == self.cprofile_stage and not waits
+        if profiling:
+            self.__profile_depth += 1
+            if self.__profile_depth == 1:
+                self.__profile.enable()
+        start_memory = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        start_cpu = time.thread_time()
+        start_wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = 0.0 if waits else time.thread_time() - start_cpu
+            memory = tracemalloc.get_traced_memory()[0] - start_memory if self.trace_memory else 0
+            if profiling:
+                self.__profile_depth -= 1
+                if self.__profile_depth == 0:
+                    self.__profile.disable()
+            self.Add(company, stage, [1, wall, cpu, memory])
+
+    def Add(self, company: int, stage: str, values: List[float]) -> None:
+        with self.__lock:
+            record = self.__records.setdefault(company, {}).setdefault(stage, [0] * len(StageProfiler.FIELDS))
+            for index, value in enumerate(values):
+                record[index] += value
+
+    # 記録を取り出して空にする(ワーカープロセスから親へ差分を渡す)
+    def Collect(self) -> Dict[int, Dict[str, List[float]]]:
+        with self.__lock:
+            records = self.__records
+            self.__records = {}
+            return records
+
+    def Merge(self, records: Dict[int, Dict[str, List[float]]]) -> None:
+        for company, stages in records.items():
+            for stage, values in stages.items():
+                self.Add(company, stage, values)
+
+    # 実行全体での段階ごとの合計
+    def GetRunTotals(self) -> Dict[str, List[float]]:
+        totals: Dict[str, List[float]] = {}
+        with self.__lock:
+            for stages in self.__records.values():
+                for stage, values in stages.items():
+                    total = totals.setdefault(stage, [0] * len(StageProfiler.FIELDS))
+                    for index, value in enumerate(values):
+                        total[index] += value
+        return {stage: totals[stage] for stage in StageProfiler.STAGES if stage in totals}
+
+    # 会社ごとの段階別(全体の処理は含まない)
+    def GetCompanies(self) -> Dict[int, Dict[str, List[float]]]:
+        with self.__lock:
+            return {company: {stage: list(values) for stage, values in stages.items()}
+                    for company, stages in self.__records.items() if company is not None}
+
+    def GetElapsed(self) -> (float, float):
+        return time.perf_counter() - self.__start_wall, time.process_time() - self.__start_cpu
+
+    # cProfileの結果をファイルへ(ワーカープロセスはプロセスIDを付けて別ファイル)
+    def DumpProfile(self, file_path: str) -> None:
+        if self.__profile is not None:
+            self.__profile.dump_stats(file_path)
+
+    # JSONで書き出す(tracemallocを使っていれば、確保量の多い行の上位も付ける)
+    def Write(self, file_path: str) -> None:
+        wall, cpu = self.GetElapsed()
+        result = {
+            'wall': wall,
+            'cpu': cpu,  # 全スレッドのCPU秒(この差がI/Oなどの待ち)
+            'run': {stage: dict(zip(StageProfiler.FIELDS, values)) for stage, values in self.GetRunTotals().items()},
+            'companies': {str(company): {stage: dict(zip(StageProfiler.FIELDS, values)) for stage, values in stages.items()}
+                          for company, stages in sorted(self.GetCompanies().items())}}
+        if self.trace_memory:
+            result['top_allocations'] = [str(statistic) for statistic in tracemalloc.take_snapshot().statistics('lineno')[:20]]
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, mode='w', encoding='UTF-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        os.replace(temporary_path, file_path)
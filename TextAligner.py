@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+import re
+import difflib
+from typing import List, Set, Tuple
+
+from TextDivider import TextDivider
+
+
+class AlignedPair:
+    def __init__(self, text1: str, text2: str, identical: bool):
+        super().__init__()
+
+        self.text1 = text1
+        self.text2 = text2
+        self.identical = identical  # 同一の文章(APIで類似度を求める必要がない)
+
+
+# 前年と当年の文章を文単位で対応付ける
+# ハッシュ(完全一致) => 長さ・文字3-gramの重なりの順に安価な手掛かりだけを使う
+class TextAligner:
+    SENTENCE_DELIMITER = re.compile('。|\n\n+')
+
+    @staticmethod
+    def GetSentences(text: str) -> List[str]:
+        sentences: List[str] = []
+        start = 0
+        for match in TextAligner.SENTENCE_DELIMITER.finditer(text):
+            sentences.append(text[start:match.end()])
+            start = match.end()
+        if start < len(text):
+            sentences.append(text[start:])
+        return sentences
+
+    @staticmethod
+    def GetShingles(text: str, size: int = 3) -> Set[str]:
+        if len(text) <= size:
+            return {text}
+        return {text[index:index + size] for index in range(len(text) - size + 1)}
+
+    @staticmethod
+    def GetOverlap(shingles1: Set[str], shingles2: Set[str]) -> float:
+        if len(shingles1) == 0 or len(shingles2) == 0:
+            return 0
+        return len(shingles1 & shingles2) / len(shingles1 | shingles2)
+
+    # 変更のあった区間内で、順序を保ったまま似ている文同士を対応付ける
+    @staticmethod
+    def __MatchChangedSentences(sentences1: List[str], sentences2: List[str], min_overlap: float, window: int) -> List[Tuple[int, int]]:
+        shingles2 = [TextAligner.GetShingles(sentence.strip()) for sentence in sentences2]
+        matches: List[Tuple[int, int]] = []
+        next_index2 = 0
+        for index1, sentence1 in enumerate(sentences1):
+            shingles1 = TextAligner.GetShingles(sentence1.strip())
+            best_index2 = -1
+            best_overlap = min_overlap
+            for index2 in range(next_index2, min(len(sentences2), next_index2 + window)):
+                # 長さが大きく違う文は比べない
+                length1 = len(sentence1)
+                length2 = len(sentences2[index2])
+                if min(length1, length2) * 3 < max(length1, length2):
+                    continue
+                overlap = TextAligner.GetOverlap(shingles1, shingles2[index2])
+                if overlap >= best_overlap:
+                    best_index2 = index2
+                    best_overlap = overlap
+            if best_index2 >= 0:
+                matches.append((index1, best_index2))
+                next_index2 = best_index2 + 1
+        return matches
+
+    # 連続して対応する文をmax_length以下のまとまりにしてペアを作る
+    @staticmethod
+    def __GroupPairs(sentences1: List[str], sentences2: List[str], matches: List[Tuple[int, int]], max_length: int) -> List[AlignedPair]:
+        pairs: List[AlignedPair] = []
+        text1 = ''
+        text2 = ''
+        for index1, index2 in matches:
+            sentence1 = sentences1[index1]
+            sentence2 = sentences2[index2]
+            if len(text1) > 0 and (len(text1) + len(sentence1) > max_length or len(text2) + len(sentence2) > max_length):
+                pairs.append(AlignedPair(text1, text2, False))
+                text1 = ''
+                text2 = ''
+            text1 += sentence1
+            text2 += sentence2
+        if len(text1) > 0:
+            pairs.append(AlignedPair(text1, text2, False))
+
+        # 1文だけでmax_lengthを超える場合は従来どおり分割して先頭から対応付ける
+        result: List[AlignedPair] = []
+        for pair in pairs:
+            if len(pair.text1) <= max_length and len(pair.text2) <= max_length:
+                result.append(pair)
+                continue
+            sub_texts1 = TextDivider.GetDividedSubstring(pair.text1, max_length)
+            sub_texts2 = TextDivider.GetDividedSubstring(pair.text2, max_length)
+            for sub_text1, sub_text2 in zip(sub_texts1, sub_texts2):
+                result.append(AlignedPair(sub_text1, sub_text2, False))
+        return result
+
+    @staticmethod
+    def GetAlignedPairs(text1: str, text2: str, max_length: int, min_overlap: float = 0.3, window: int = 8) -> List[AlignedPair]:
+        sentences1 = TextAligner.GetSentences(text1)
+        sentences2 = TextAligner.GetSentences(text2)
+
+        # 空白を除いた文の完全一致で大まかに対応付ける
+        keys1 = [sentence.strip() for sentence in sentences1]
+        keys2 = [sentence.strip() for sentence in sentences2]
+        matcher = difflib.SequenceMatcher(None, keys1, keys2, autojunk=False)
+
+        pairs: List[AlignedPair] = []
+        changed_matches: List[Tuple[int, int]] = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                pairs.append(AlignedPair(''.join(sentences1[i1:i2]), ''.join(sentences2[j1:j2]), True))
+            elif tag == 'replace':
+                matches = TextAligner.__MatchChangedSentences(sentences1[i1:i2], sentences2[j1:j2], min_overlap, window)
+                changed_matches += [(i1 + index1, j1 + index2) for index1, index2 in matches]
+            # 'delete'/'insert' は対応する文がないので類似度0として扱う
+
+        # 離れた箇所の変更もまとめて送り、呼び出し回数を減らす
+        pairs += TextAligner.__GroupPairs(sentences1, sentences2, changed_matches, max_length)
+        return pairs
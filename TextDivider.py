@@ -0,0 +1,86 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import glob
+import time
+from typing import Iterator, List, Tuple
+
+
+# 長文をAPIの入力長以下に分割する
+# 。の直後 => 空行(\n\n)の1文字目の直後 => max_length文字目の直後 の優先順で区切る
+class TextDivider:
+    @staticmethod
+    def GetDividedRanges(text: str, max_length: int) -> Iterator[Tuple[int, int]]:
+        # 文字列をコピーせず、先頭から1回走査して(start, end)を順に返す
+        text_length = len(text)
+        start = 0
+        while True:
+            if text_length - start < max_length:
+                yield (start, text_length)
+                return
+
+            index = text.rfind('。', start, start + max_length)
+            if index < 0:
+                index = text.rfind('\n\n', start, start + max_length)  # try to find double newlines
+            if index < 0:
+                index = start + max_length
+
+            end = min(index + 1, text_length)
+            yield (start, end)
+            start = end
+
+    @staticmethod
+    def GetDividedSubstring(text: str, max_length: int) -> List[str]:
+        return [text[start:end] for start, end in TextDivider.GetDividedRanges(text, max_length)]
+
+
+# 以前の再帰版(ベンチマークの比較用)
+def GetDividedSubstringRecursive(text: str, max_length: int) -> List[str]:
+    if len(text) < max_length:
+        return [text]
+
+    index = text.rfind('。', 0, max_length)
+    if index < 0:
+        index = text.rfind('\n\n', 0, max_length)  # try to find double newlines
+    if index < 0:
+        if len(text) < max_length:
+            return [text]
+        else:
+            index = max_length
+
+    head = text[: index + 1]
+    tail = text[index + 1:]
+    result: List[str] = [head]
+    for text in GetDividedSubstringRecursive(tail, max_length):
+        result.append(text)
+    return result
+
+
+if __name__ == '__main__':
+    # ベンチマーク: python TextDivider.py [docsの数]
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    paths = glob.glob(os.path.join(data_directory, 'interim', '*', 'docs', '*.txt'))
+    if len(paths) == 0:
+        print('no documents under ' + data_directory)
+        sys.exit(1)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    paths = sorted(paths, key=lambda path: -os.path.getsize(path))[:count]
+    texts: List[str] = []
+    for path in paths:
+        with open(path, mode='r', encoding='UTF-8') as f:
+            texts.append(f.read())
+    print('{0} largest docs, {1} chars in total (max {2})'.format(len(texts), sum(len(text) for text in texts), max(len(text) for text in texts)))
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    for max_length in [500, 1000, 2000]:
+        start = time.perf_counter()
+        expected = [GetDividedSubstringRecursive(text, max_length) for text in texts]
+        recursive_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = [TextDivider.GetDividedSubstring(text, max_length) for text in texts]
+        iterative_time = time.perf_counter() - start
+
+        print('max_length={0:>5}: recursive {1:>8.2f}ms, iterative {2:>8.2f}ms, identical={3}'.format(
+            max_length, recursive_time * 1000, iterative_time * 1000, expected == actual))
@@ -3,24 +3,346 @@
 # this code is based on https://qiita.com/gossy5454/items/83072418fb0c5f3e269f by @gossy5454
 
 import os
+import io
+import base64
+import time
+import random
+import socket
+import datetime
+import email.utils
+import asyncio
+import concurrent.futures
+import queue
+import collections
+import threading
+import http.client
+import urllib.parse
 import urllib.request
+import urllib.response
 import json
 import configparser
 import codecs
+from typing import List
+
+from ResponseCache import ResponseCache
+from TextDivider import TextDivider
+from ApiMetrics import ApiMetrics
+
+
+# keep-alive接続を使い回すHTTPコネクションプール
+# プロキシはurlopenと同じく環境変数(http_proxy/https_proxy/no_proxy)などから取る
+class HttpConnectionPool:
+    def __init__(self, pool_size: int = 4, timeout: float = 60, proxies: dict = None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.proxies = proxies if proxies is not None else urllib.request.getproxies()  # スキーム => プロキシURL
+        self.created_connections = 0  # 新規に張った接続数(再利用の確認用)
+        self.__idle_connections = {}
+        self.__proxy_urls = {}  # (スキーム, ホスト, ポート) => プロキシ(使わないならNone)
+        self.__lock = threading.Lock()
+
+    # ホスト毎の待機中接続キューを取得
+    def __GetQueue(self, key) -> queue.LifoQueue:
+        with self.__lock:
+            if key not in self.__idle_connections:
+                self.__idle_connections[key] = queue.LifoQueue(maxsize=self.pool_size)
+            return self.__idle_connections[key]
+
+    # 接続先に使うプロキシ(no_proxyの対象や未設定ならNone)
+    def __GetProxy(self, key) -> urllib.parse.SplitResult:
+        with self.__lock:
+            if key in self.__proxy_urls:
+                return self.__proxy_urls[key]
+        scheme, host, port = key
+        proxy_url = self.proxies.get(scheme)
+        proxy = None
+        if proxy_url and not urllib.request.proxy_bypass('{0}:{1}'.format(host, port)):
+            proxy = urllib.parse.urlsplit(proxy_url if '://' in proxy_url else 'http://' + proxy_url)
+        with self.__lock:
+            self.__proxy_urls[key] = proxy
+        return proxy
+
+    # Proxy-Authorizationヘッダ(プロキシURLに認証情報がなければ空)
+    @staticmethod
+    def GetProxyHeaders(proxy: urllib.parse.SplitResult) -> dict:
+        if proxy.username is None:
+            return {}
+        credentials = urllib.parse.unquote(proxy.username) + ':' + urllib.parse.unquote(proxy.password or '')
+        return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode('ascii')}
+
+    def __NewConnection(self, scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+        with self.__lock:
+            self.created_connections += 1
+        proxy = self.__GetProxy((scheme, host, port))
+        if proxy is None:
+            if scheme == 'https':
+                return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+            return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        proxy_port = proxy.port or (443 if proxy.scheme == 'https' else 80)
+        if scheme == 'https':
+            # プロキシへCONNECTでトンネルを張り、その中でTLS
+            connection = http.client.HTTPSConnection(proxy.hostname, proxy_port, timeout=self.timeout)
+            connection.set_tunnel(host, port, headers=HttpConnectionPool.GetProxyHeaders(proxy))
+            return connection
+        # httpはプロキシへ絶対URLで送る(urlopenで)
+        return http.client.HTTPConnection(proxy.hostname, proxy_port, timeout=self.timeout)
+
+    # 待機中の接続を返却(なければ新規作成)
+    def __Acquire(self, key) -> (http.client.HTTPConnection, bool):
+        try:
+            return self.__GetQueue(key).get_nowait(), True
+        except queue.Empty:
+            return self.__NewConnection(*key), False
 
+    # 接続をプールへ戻す(満杯なら閉じる)
+    def __Release(self, key, connection: http.client.HTTPConnection) -> None:
+        try:
+            self.__GetQueue(key).put_nowait(connection)
+        except queue.Full:
+            connection.close()
 
-# COTOHA API操作用クラス
-class CotohaApi:
-    # 初期化
-    def __init__(self, client_id, client_secret, developer_api_base_url, access_token_publish_url):
+    # プールの接続で1回送受信し、(レスポンス, 本文)を返す
+    def __Exchange(self, key, method: str, path: str, data: bytes, headers: dict) -> (http.client.HTTPResponse, bytes):
+        connection, reused = self.__Acquire(key)
+        try:
+            connection.request(method, path, body=data, headers=headers)
+            res = connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+            # サーバ側で切断済みの接続だった場合は新しい接続で1度だけ再送
+            connection = self.__NewConnection(*key)
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                res = connection.getresponse()
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+
+        try:
+            body = res.read()
+        except Exception:
+            connection.close()
+            raise
+
+        if res.will_close:
+            connection.close()
+        else:
+            self.__Release(key, connection)
+        return res, body
+
+    # urllib.request.urlopen互換: HTTPErrorを送出し、read()可能なレスポンスを返す
+    def urlopen(self, req: urllib.request.Request):
+        url = req.full_url
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        headers = dict(req.header_items())
+        headers['Connection'] = 'keep-alive'
+        proxy = self.__GetProxy(key)
+        if proxy is not None and scheme == 'http':
+            path = url
+            headers['Host'] = parts.netloc
+            headers.update(HttpConnectionPool.GetProxyHeaders(proxy))
+
+        try:
+            res, body = self.__Exchange(key, req.get_method(), path, req.data, headers)
+        except OSError as e:
+            # urllib.request.urlopenと同じく通信のエラー(名前解決、TLS、到達不能なども)はURLErrorにする
+            raise urllib.request.URLError(e) from e
+
+        if res.status >= 400:
+            raise urllib.request.HTTPError(url, res.status, res.reason, res.headers, io.BytesIO(body))
+        return urllib.response.addinfourl(io.BytesIO(body), res.headers, url, res.status)
+
+    # 待機中の接続をすべて閉じる
+    def close(self) -> None:
+        with self.__lock:
+            queues = list(self.__idle_connections.values())
+            self.__idle_connections = {}
+        for idle_queue in queues:
+            while True:
+                try:
+                    idle_queue.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+# APIの呼び出しに失敗した場合の例外(リトライ後も回復しなかったもの)
+class CotohaApiError(Exception):
+    def __init__(self, endpoint: str, status: int, reason: str):
+        super().__init__('{0}: {1} {2}'.format(endpoint, status, reason))
+        self.endpoint = endpoint
+        self.status = status  # HTTPステータス(通信エラーならNone)
+        self.reason = reason
+
+    # プロセスプールの子プロセスから親へ渡せるようにする
+    def __reduce__(self):
+        return (CotohaApiError, (self.endpoint, self.status, self.reason))
+
+
+# 1日あたりの呼び出し上限に達した場合の例外
+class QuotaExceededError(CotohaApiError):
+    def __init__(self, daily_limit: int):
+        super().__init__('quota', None, 'daily request limit reached: {0}'.format(daily_limit))
+        self.daily_limit = daily_limit
+
+    def __reduce__(self):
+        return (QuotaExceededError, (self.daily_limit,))
+
+
+# 一時的な失敗(429/5xx/タイムアウト/通信エラー)のリトライ方針
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def IsRetryable(error: Exception) -> bool:
+        if isinstance(error, urllib.request.HTTPError):
+            return error.code == 429 or error.code >= 500
+        return isinstance(error, (urllib.request.URLError, socket.timeout, ConnectionError, http.client.HTTPException))
+
+    # Retry-Afterヘッダ(秒数 or 日時)を秒数に変換
+    @staticmethod
+    def GetRetryAfter(error: Exception) -> float:
+        if not isinstance(error, urllib.request.HTTPError) or error.headers is None:
+            return None
+        value = error.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds())
+
+    # attempt回目(0始まり)の失敗後の待ち時間: 指数バックオフ + フルジッタ
+    def GetDelay(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = RetryPolicy.GetRetryAfter(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+# トークンバケット方式のレート制限(スレッドセーフ)
+class RateLimiter:
+    TOKENS, UPDATED, DAY, DAILY_COUNT = range(4)
+
+    # mp_contextを指定すると状態をプロセス間で共有する(ProcessPoolExecutorのinitargsで子プロセスへ渡す)
+    # daily_count_pathを指定すると1日の呼び出し回数をファイルに残し、同じ日の次の実行へ引き継ぐ
+    def __init__(self, requests_per_second: float, burst_size: int = 1, daily_limit: int = 0, mp_context=None, daily_count_path: str = None):
+        self.requests_per_second = requests_per_second  # 0以下なら制限しない
+        self.burst_size = burst_size
+        self.daily_limit = daily_limit  # 0なら無制限
+        self.daily_count_path = daily_count_path if daily_limit > 0 and daily_count_path else None
+        today = datetime.date.today()
+        state = [float(burst_size), time.monotonic(), float(today.toordinal()), float(self.__LoadDailyCount(today))]
+        if mp_context is None:
+            self.__state = state
+            self.__lock = threading.Lock()
+        else:
+            self.__state = mp_context.Array('d', state, lock=False)
+            self.__lock = mp_context.Lock()
+
+    # config.iniの[COTOHA API]から生成
+    @staticmethod
+    def FromConfig(config_path: str, mp_context=None) -> 'RateLimiter':
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        REQUESTS_PER_SECOND = config.getfloat("COTOHA API", "Requests Per Second", fallback=0)
+        BURST_SIZE = config.getint("COTOHA API", "Burst Size", fallback=1)
+        DAILY_REQUEST_LIMIT = config.getint("COTOHA API", "Daily Request Limit", fallback=0)
+        DAILY_COUNT_PATH = config.get("COTOHA API", "Daily Count Path", fallback="")
+        daily_count_path = os.path.dirname(os.path.abspath(config_path)) + "/" + DAILY_COUNT_PATH if len(DAILY_COUNT_PATH) > 0 else None
+        return RateLimiter(REQUESTS_PER_SECOND, BURST_SIZE, DAILY_REQUEST_LIMIT, mp_context, daily_count_path)
+
+    @property
+    def daily_count(self) -> int:
+        return int(self.__state[RateLimiter.DAILY_COUNT])
+
+    # ファイルに残した今日の呼び出し回数(日付が変わっていれば0)
+    def __LoadDailyCount(self, today: datetime.date) -> int:
+        if self.daily_count_path is None or not os.path.exists(self.daily_count_path):
+            return 0
+        with open(self.daily_count_path, mode='r', encoding='UTF-8') as f:
+            saved = json.load(f)
+        return int(saved['count']) if saved['date'] == today.isoformat() else 0
+
+    # 書きかけのファイルを残さないよう、一時ファイルから置き換える(ロックを持って呼ぶ)
+    def __SaveDailyCount(self, day: float, count: float) -> None:
+        directory = os.path.dirname(os.path.abspath(self.daily_count_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary_path = self.daily_count_path + '.tmp'
+        with open(temporary_path, mode='w', encoding='UTF-8') as f:
+            json.dump({'date': datetime.date.fromordinal(int(day)).isoformat(), 'count': int(count)}, f)
+        os.replace(temporary_path, self.daily_count_path)
+
+    # 1回分を予約し、必要な待ち時間[s]を返す
+    def __Reserve(self) -> float:
+        state = self.__state
+        with self.__lock:
+            today = float(datetime.date.today().toordinal())
+            if today != state[RateLimiter.DAY]:
+                state[RateLimiter.DAY] = today
+                state[RateLimiter.DAILY_COUNT] = 0
+            if self.daily_limit > 0 and state[RateLimiter.DAILY_COUNT] >= self.daily_limit:
+                raise QuotaExceededError(self.daily_limit)
+            state[RateLimiter.DAILY_COUNT] += 1
+            if self.daily_count_path is not None:
+                self.__SaveDailyCount(state[RateLimiter.DAY], state[RateLimiter.DAILY_COUNT])
+
+            if self.requests_per_second <= 0:
+                return 0
+
+            # time.monotonic()はプロセス間で共通の時計
+            now = time.monotonic()
+            tokens = min(float(self.burst_size), state[RateLimiter.TOKENS] + (now - state[RateLimiter.UPDATED]) * self.requests_per_second)
+            state[RateLimiter.UPDATED] = now
+            state[RateLimiter.TOKENS] = tokens - 1
+            if tokens - 1 >= 0:
+                return 0
+            return -(tokens - 1) / self.requests_per_second
+
+    # トークンが得られるまで待つ(バケットに余裕があれば待たない)
+    def Acquire(self) -> None:
+        wait = self.__Reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+# アクセストークンの取得・有効期限管理(スレッドセーフ)
+class AccessTokenManager:
+    def __init__(self, client_id, client_secret, access_token_publish_url, connection_pool: HttpConnectionPool, refresh_margin: float = 60,
+                 retry_policy: RetryPolicy = None):
         self.client_id = client_id
         self.client_secret = client_secret
-        self.developer_api_base_url = developer_api_base_url
         self.access_token_publish_url = access_token_publish_url
-        self.getAccessToken()
+        self.connection_pool = connection_pool
+        self.refresh_margin = refresh_margin  # 期限のこの秒数前に更新
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.publish_count = 0
+        self.__access_token = None
+        self.__expires_at = None  # time.monotonic()基準, Noneなら期限不明
+        self.__lifetime = None
+        self.__lock = threading.Lock()
 
     # アクセストークン取得
-    def getAccessToken(self):
+    def __Publish(self) -> None:
         # アクセストークン取得URL指定
         url = self.access_token_publish_url
 
@@ -41,413 +363,524 @@ class CotohaApi:
         # リクエスト生成
         req = urllib.request.Request(url, data, headers)
 
-        # リクエストを送信し、レスポンスを受信
-        res = urllib.request.urlopen(req)
-
-        # レスポンスボディ取得
-        res_body = res.read()
+        # リクエストを送信し、レスポンスボディを受信(一時的な失敗はリトライし、回復しなければCotohaApiError)
+        attempt = 0
+        while True:
+            try:
+                res_body = self.connection_pool.urlopen(req).read()
+                break
+            except Exception as e:
+                if not RetryPolicy.IsRetryable(e) or attempt + 1 >= self.retry_policy.max_attempts:
+                    status = e.code if isinstance(e, urllib.request.HTTPError) else None
+                    raise CotohaApiError('token', status, str(getattr(e, 'reason', e))) from e
+                time.sleep(self.retry_policy.GetDelay(attempt, e))
+                attempt += 1
 
         # レスポンスボディをJSONからデコード
         res_body = json.loads(res_body)
 
-        # レスポンスボディからアクセストークンを取得
-        self.access_token = res_body["access_token"]
-
-    # 構文解析API
-
-    def parse(self, sentence):
-        # 構文解析API URL指定
-        url = self.developer_api_base_url + "v1/parse"
+        # レスポンスボディからアクセストークンと有効期限を取得
+        self.__access_token = res_body["access_token"]
+        self.__expires_at = None
+        self.__lifetime = None
+        if "expires_in" in res_body:
+            self.__lifetime = float(res_body["expires_in"])
+            self.__expires_at = time.monotonic() + self.__lifetime
+        self.publish_count += 1
+
+    def __IsExpiring(self) -> bool:
+        if self.__access_token is None:
+            return True
+        if self.__expires_at is None:
+            return False
+        # 有効期間が短いトークンでも毎回更新にならないよう、余裕は期間の半分まで
+        margin = min(self.refresh_margin, self.__lifetime / 2)
+        return time.monotonic() >= self.__expires_at - margin
+
+    # 有効なアクセストークンを返す(更新中は他のスレッドは待つ)
+    def GetToken(self) -> str:
+        with self.__lock:
+            if self.__IsExpiring():
+                self.__Publish()
+            return self.__access_token
+
+    # 強制的に取得し直す
+    def Refresh(self) -> str:
+        with self.__lock:
+            self.__Publish()
+            return self.__access_token
+
+    # 401を受けたトークンを無効にする(既に他で更新済みなら何もしない)
+    def Invalidate(self, access_token: str) -> None:
+        with self.__lock:
+            if access_token == self.__access_token:
+                self.__access_token = None
+
+
+# パイプラインを流れる1回分のリクエスト
+class ApiRequest:
+    def __init__(self, name: str, url: str, body: dict):
+        self.name = name  # エンドポイント名(parse, ne, ...)
+        self.url = url
+        self.path = urllib.parse.urlsplit(url).path
+        self.body = body
+        # リクエストボディ指定をJSONにエンコード
+        self.data = json.dumps(body).encode()
         # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
+        self.headers = {
             "Content-Type": "application/json;charset=UTF-8",
         }
-        # リクエストボディ指定
-        data = {
-            "sentence": sentence
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: parse> " + e.reason)
-                return json.loads('{}')
+        self.attempts = 0  # 実際に送信した回数(0ならメモかキャッシュで済んだ)
 
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
 
-    # 固有表現抽出API
+# ミドルウェア: エンドポイントごとの呼び出し回数、バイト数、文字数、応答時間、エラーを記録
+# 先頭に置き、メモやキャッシュで済んだ呼び出しも数える
+class MetricsStage:
+    def __init__(self, metrics: ApiMetrics):
+        self.metrics = metrics
 
-    def ne(self, sentence):
-        # 固有表現抽出API URL指定
-        url = self.developer_api_base_url + "v1/ne"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "sentence": sentence
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
+    def __call__(self, request: ApiRequest, call_next) -> bytes:
+        start = time.perf_counter()
+        body = b""
+        failed = True
         try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
+            body = call_next(request)
+            failed = False
+            return body
+        finally:
+            self.metrics.AddCall(request.name, len(request.data), ApiMetrics.GetTextLength(request.body), len(body),
+                                 time.perf_counter() - start, request.attempts > 0, failed)
+
+
+# ミドルウェア: レスポンスキャッシュ(ヒットすれば以降の段を通らない)
+class CacheStage:
+    def __init__(self, response_cache: ResponseCache):
+        self.response_cache = response_cache
+
+    def __call__(self, request: ApiRequest, call_next) -> bytes:
+        body = self.response_cache.Get(request.path, request.data)
+        if body is not None:
+            return body
+        body = call_next(request)
+        # resultのない応答は次の実行で送り直す(キャッシュすると毎回空の結果が返る)
+        if CacheStage.HasResult(body):
+            self.response_cache.Put(request.path, request.data, body)
+        return body
+
+    @staticmethod
+    def HasResult(body: bytes) -> bool:
+        try:
+            result = json.loads(body)
+        except ValueError:
+            return False
+        return isinstance(result, dict) and "result" in result
+
+
+# ミドルウェア: 実行中のメモ(同じエンドポイントへ同じ本文を送るのは1回だけ)
+# 同時に来た重複リクエストは先に送った方の結果を待つ
+class MemoStage:
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries  # 古いものから忘れる
+        self.saved_count = 0  # 送らずに済んだ回数
+        self.__results = collections.OrderedDict()  # キー => concurrent.futures.Future
+        self.__lock = threading.Lock()
+
+    def __call__(self, request: ApiRequest, call_next) -> bytes:
+        key = ResponseCache.GetKey(request.path, request.data)
+        with self.__lock:
+            future = self.__results.get(key)
+            sent = future is not None
+            if sent:
+                self.__results.move_to_end(key)
             else:
-                print("<Error: ne> " + e.reason)
-                return json.loads('{}')
+                future = concurrent.futures.Future()
+                self.__results[key] = future
+                if len(self.__results) > self.max_entries:
+                    self.__results.popitem(last=False)
 
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+        if sent:
+            body = future.result()
+            with self.__lock:
+                self.saved_count += 1
+            return body
 
-    # 照応解析API
+        try:
+            body = call_next(request)
+        except BaseException as e:
+            # 失敗は覚えず、次の呼び出しで送り直す
+            with self.__lock:
+                if self.__results.get(key) is future:
+                    del self.__results[key]
+            future.set_exception(e)
+            raise
+        future.set_result(body)
+        return body
+
+
+# ミドルウェア: アクセストークンを付与し、401なら取得し直して1度だけ再リクエスト
+class AuthStage:
+    def __init__(self, token_manager: AccessTokenManager):
+        self.token_manager = token_manager
+
+    def __call__(self, request: ApiRequest, call_next) -> bytes:
+        access_token = self.token_manager.GetToken()
+        request.headers["Authorization"] = "Bearer " + access_token
+        try:
+            return call_next(request)
+        except urllib.request.HTTPError as e:
+            if e.code != 401:
+                raise CotohaApiError(request.name, e.code, str(e.reason)) from e
 
-    def coreference(self, document):
-        # 照応解析API 取得URL指定
-        url = self.developer_api_base_url + "beta/coreference"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "document": document
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
+        print("get access token")
+        self.token_manager.Invalidate(access_token)
+        request.headers["Authorization"] = "Bearer " + self.token_manager.GetToken()
         try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
+            return call_next(request)
         except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: coreference> " + e.reason)
-                return json.loads('{}')
+            raise CotohaApiError(request.name, e.code, str(e.reason)) from e
+
+
+# ミドルウェア: 一時的な失敗を指数バックオフでリトライ(401はそのまま上へ返す)
+class RetryStage:
+    def __init__(self, retry_policy: RetryPolicy):
+        self.retry_policy = retry_policy
+
+    def __call__(self, request: ApiRequest, call_next) -> bytes:
+        attempt = 0
+        while True:
+            try:
+                return call_next(request)
+            except Exception as e:
+                if isinstance(e, urllib.request.HTTPError) and e.code == 401:
+                    raise
+                if isinstance(e, CotohaApiError):
+                    raise  # 上限到達などは包み直さない
+                if not RetryPolicy.IsRetryable(e) or attempt + 1 >= self.retry_policy.max_attempts:
+                    status = e.code if isinstance(e, urllib.request.HTTPError) else None
+                    raise CotohaApiError(request.name, status, str(getattr(e, 'reason', e))) from e
+                time.sleep(self.retry_policy.GetDelay(attempt, e))
+                attempt += 1
+
+
+# ミドルウェア: レート制限(送信の度にトークンを消費)
+class RateLimitStage:
+    def __init__(self, rate_limiter: RateLimiter):
+        self.rate_limiter = rate_limiter
+
+    def __call__(self, request: ApiRequest, call_next) -> bytes:
+        self.rate_limiter.Acquire()
+        return call_next(request)
+
+
+# 終端: 接続プールでリクエストを送信し、レスポンスボディを返す
+class TransportStage:
+    def __init__(self, connection_pool: HttpConnectionPool, metrics: ApiMetrics = None):
+        self.connection_pool = connection_pool
+        self.metrics = metrics  # 送信回数と1回ごとの応答時間(Noneなら記録しない)
+
+    def __call__(self, request: ApiRequest) -> bytes:
+        request.attempts += 1
+        start = time.perf_counter()
+        try:
+            # リクエスト生成
+            req = urllib.request.Request(request.url, request.data, request.headers)
+            # リクエストを送信し、レスポンスを受信
+            res = self.connection_pool.urlopen(req)
+            # レスポンスボディ取得
+            return res.read()
+        finally:
+            if self.metrics is not None:
+                self.metrics.AddSend(request.name, time.perf_counter() - start, request.attempts > 1)
 
-        # レスポンスボディ取得
-        res_body = res.read()
+
+# COTOHA API操作用クラス
+class CotohaApi:
+    # 初期化
+    def __init__(self, client_id, client_secret, developer_api_base_url, access_token_publish_url, pool_size=4, rate_limiter=None, response_cache=None, retry_policy=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.developer_api_base_url = developer_api_base_url
+        self.access_token_publish_url = access_token_publish_url
+        # 全エンドポイントで共有する接続プール
+        self.connection_pool = HttpConnectionPool(pool_size)
+        # 全エンドポイントで共有するレート制限
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(0)
+        # レスポンスキャッシュ(Noneなら使わない)
+        self.response_cache = response_cache
+        # 一時的な失敗のリトライ方針
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # アクセストークン管理(最初に送信する時に取得するので、キャッシュだけで済めば取得しない)
+        self.token_manager = AccessTokenManager(client_id, client_secret, access_token_publish_url, self.connection_pool, retry_policy=self.retry_policy)
+
+        # エンドポイントごとのメトリクス
+        self.metrics = ApiMetrics()
+        # 実行中の重複呼び出しを省くメモ
+        self.memo = MemoStage()
+
+        # リクエストが通る段(先頭から順に実行され、最後にtransportで送信)
+        self.stages = [MetricsStage(self.metrics), self.memo]
+        if response_cache is not None:
+            self.stages.append(CacheStage(response_cache))
+        self.stages.append(AuthStage(self.token_manager))
+        self.stages.append(RetryStage(self.retry_policy))
+        self.stages.append(RateLimitStage(self.rate_limiter))
+        self.transport = TransportStage(self.connection_pool, self.metrics)
+
+    # config.iniの[COTOHA API]から生成(rate_limiterを渡すと設定値の代わりにそれを使う)
+    @staticmethod
+    def FromConfig(config_path: str, rate_limiter: RateLimiter = None) -> 'CotohaApi':
+        APP_ROOT = os.path.dirname(os.path.abspath(config_path)) + "/"
+
+        # 設定値取得
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        CLIENT_ID = config.get("COTOHA API", "Developer Client id")
+        CLIENT_SECRET = config.get("COTOHA API", "Developer Client secret")
+        DEVELOPER_API_BASE_URL = config.get("COTOHA API", "Developer API Base URL")
+        ACCESS_TOKEN_PUBLISH_URL = config.get("COTOHA API", "Access Token Publish URL")
+        CONNECTION_POOL_SIZE = config.getint("COTOHA API", "Connection Pool Size", fallback=4)
+        RESPONSE_CACHE_PATH = config.get("COTOHA API", "Response Cache Path", fallback="")
+        RESPONSE_CACHE_MAX_SIZE_MB = config.getint("COTOHA API", "Response Cache Max Size MB", fallback=512)
+        RETRY_MAX_ATTEMPTS = config.getint("COTOHA API", "Retry Max Attempts", fallback=4)
+        RETRY_BASE_DELAY = config.getfloat("COTOHA API", "Retry Base Delay", fallback=0.5)
+        RETRY_MAX_DELAY = config.getfloat("COTOHA API", "Retry Max Delay", fallback=30)
+
+        # COTOHA APIインスタンス生成
+        if rate_limiter is None:
+            rate_limiter = RateLimiter.FromConfig(config_path)
+        response_cache = ResponseCache(APP_ROOT + RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_SIZE_MB * 1024 * 1024) if len(RESPONSE_CACHE_PATH) > 0 else None
+        retry_policy = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        return CotohaApi(CLIENT_ID, CLIENT_SECRET, DEVELOPER_API_BASE_URL, ACCESS_TOKEN_PUBLISH_URL, CONNECTION_POOL_SIZE, rate_limiter, response_cache, retry_policy)
+
+    # アクセストークン(期限切れ間近なら再取得)
+    @property
+    def access_token(self) -> str:
+        return self.token_manager.GetToken()
+
+    # アクセストークンを強制的に取得し直す
+    def getAccessToken(self) -> str:
+        return self.token_manager.Refresh()
+
+    # 段を追加(indexを省略すると送信直前に入る)
+    def AddStage(self, stage, index: int = None) -> None:
+        if index is None:
+            self.stages.append(stage)
+        else:
+            self.stages.insert(index, stage)
+
+    def __Dispatch(self, request: ApiRequest, index: int) -> bytes:
+        if index >= len(self.stages):
+            return self.transport(request)
+        return self.stages[index](request, lambda next_request: self.__Dispatch(next_request, index + 1))
+
+    # 全エンドポイント共通のリクエスト処理
+    def Request(self, name: str, path: str, body: dict) -> dict:
+        request = ApiRequest(name, self.developer_api_base_url + path, body)
+        res_body = self.__Dispatch(request, 0)
         # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+        result = json.loads(res_body)
+        if "result" not in result:
+            self.metrics.Add(name, "empty_results")  # 呼び出し側で捨てられる応答
+        return result
 
-    # キーワード抽出API
+    # 構文解析API
+    def parse(self, sentence):
+        return self.Request("parse", "v1/parse", {"sentence": sentence})
 
-    def keyword(self, document):
-        # キーワード抽出API URL指定
-        url = self.developer_api_base_url + "v1/keyword"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "document": document
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: keyword> " + e.reason)
-                return json.loads('{}')
+    # 固有表現抽出API
+    def ne(self, sentence):
+        return self.Request("ne", "v1/ne", {"sentence": sentence})
 
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+    # 照応解析API
+    def coreference(self, document):
+        return self.Request("coreference", "beta/coreference", {"document": document})
 
-    # 類似度算出API
+    # キーワード抽出API
+    def keyword(self, document):
+        return self.Request("keyword", "v1/keyword", {"document": document})
+
+    # 1文で上限を超えるものはTextDividerの区切り方で分ける
+    # (区切りが見つからずに切った所はmax_length + 1文字になるので、最後の1文字を分ける)
+    @staticmethod
+    def __GetPieces(sentences: List[str], max_length: int) -> List[str]:
+        pieces: List[str] = []
+        for sentence in sentences:
+            if len(sentence) <= max_length:
+                pieces.append(sentence)
+                continue
+            for start, end in TextDivider.GetDividedRanges(sentence, max_length):
+                if end - start > max_length:
+                    pieces.append(sentence[start:start + max_length])
+                    start += max_length
+                if end > start:  # 最後に空の範囲が返ることがある
+                    pieces.append(sentence[start:end])
+        return pieces
+
+    # 文の配列をmax_length文字以下ずつの配列にまとめる
+    # keyword/coreferenceは配列を1つの文書の文として扱うので、まとめるのは同じ文書の文だけにする
+    @staticmethod
+    def PackSentences(sentences: List[str], max_length: int) -> List[List[str]]:
+        batches: List[List[str]] = []
+        batch: List[str] = []
+        length = 0
+        for sentence in CotohaApi.__GetPieces(sentences, max_length):
+            if len(batch) > 0 and length + len(sentence) > max_length:
+                batches.append(batch)
+                batch = []
+                length = 0
+            batch.append(sentence)
+            length += len(sentence)
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    # 分けて送ったキーワード抽出の結果を、キーワードごとに最大のスコアで1つにまとめる
+    @staticmethod
+    def MergeKeywords(responses: List[dict]) -> dict:
+        scores = {}
+        for response in responses:
+            for keyword in response.get('result', []):
+                scores[keyword['form']] = max(scores.get(keyword['form'], 0), keyword['score'])
+        return {'result': [{'form': form, 'score': score} for form, score in sorted(scores.items(), key=lambda x: -x[1])]}
+
+    # キーワード抽出API(長い文書): 文を1チャンクずつではなく配列でまとめて送る
+    def keywordDocument(self, sentences: List[str], max_length: int) -> dict:
+        return CotohaApi.MergeKeywords([self.keyword(batch) for batch in CotohaApi.PackSentences(sentences, max_length)])
+
+    # 照応解析API(長い文書): 照応関係はまとめた範囲の中でしか求まらないので、まとめた単位の結果を返す
+    def coreferenceDocument(self, sentences: List[str], max_length: int) -> List[dict]:
+        return [self.coreference(batch) for batch in CotohaApi.PackSentences(sentences, max_length)]
 
+    # 類似度算出API
     def similarity(self, s1, s2):
-        # 類似度算出API URL指定
-        url = self.developer_api_base_url + "v1/similarity"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "s1": s1,
-            "s2": s2
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: similarity> " + e.reason)
-                return json.loads('{}')
-
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+        return self.Request("similarity", "v1/similarity", {"s1": s1, "s2": s2})
 
     # 文タイプ判定API
-
     def sentenceType(self, sentence):
-        # 文タイプ判定API URL指定
-        url = self.developer_api_base_url + "v1/sentence_type"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "sentence": sentence
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: sentenceType> " + e.reason)
-                return json.loads('{}')
-
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+        return self.Request("sentenceType", "v1/sentence_type", {"sentence": sentence})
 
     # ユーザ属性推定API
-
     def userAttribute(self, document):
-        # ユーザ属性推定API URL指定
-        url = self.developer_api_base_url + "beta/user_attribute"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "document": document
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: userAttribute> " + e.reason)
-                return json.loads('{}')
-
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+        return self.Request("userAttribute", "beta/user_attribute", {"document": document})
 
     # 感情分析API
-
     def sentiment(self, sentence):
-        # 照応解析API 取得URL指定
-        url = self.developer_api_base_url + "v1/sentiment"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "sentence": sentence
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: sentiment> " + e.reason)
-                return json.loads('{}')
-
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+        return self.Request("sentiment", "v1/sentiment", {"sentence": sentence})
 
     # 要約API
-
     def summary(self, document, sent_len):
-        # 照応解析API 取得URL指定
-        url = self.developer_api_base_url + "beta/summary"
-        # ヘッダ指定
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        # リクエストボディ指定
-        data = {
-            "document": document,
-            "sent_len": sent_len
-        }
-        # リクエストボディ指定をJSONにエンコード
-        data = json.dumps(data).encode()
-        # リクエスト生成
-        req = urllib.request.Request(url, data, headers)
-        # リクエストを送信し、レスポンスを受信
-        try:
-            res = urllib.request.urlopen(req)
-        # リクエストでエラーが発生した場合の処理
-        except urllib.request.HTTPError as e:
-            # ステータスコードが401 Unauthorizedならアクセストークンを取得し直して再リクエスト
-            if e.code == 401:
-                print("get access token")
-                self.access_token = self.getAccessToken(self.client_id, self.client_secret)
-                headers["Authorization"] = "Bearer " + self.access_token
-                req = urllib.request.Request(url, data, headers)
-                res = urllib.request.urlopen(req)
-            # 401以外のエラーなら原因を表示
-            else:
-                print("<Error: summary> " + e.reason)
-                return json.loads('{}')
+        return self.Request("summary", "beta/summary", {"document": document, "sent_len": sent_len})
+
+    # 接続とキャッシュを解放
+    def close(self) -> None:
+        self.connection_pool.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+
+# COTOHA API非同期操作用クラス(同時リクエスト数を制限)
+# 同期版と同じパイプラインをワーカースレッド上で実行する
+class AsyncCotohaApi:
+    def __init__(self, cotoha_api: CotohaApi, max_concurrency: int = 4):
+        self.cotoha_api = cotoha_api
+        self.max_concurrency = max_concurrency
+        # セマフォは作った時点のイベントループに結び付く(3.9以前)ので、実行中のループで作る
+        self.__semaphore = None
+        self.__semaphore_loop = None
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+
+    # config.iniの[COTOHA API]から生成
+    @staticmethod
+    def FromConfig(config_path: str, rate_limiter: RateLimiter = None) -> 'AsyncCotohaApi':
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        MAX_CONCURRENCY = config.getint("COTOHA API", "Max Concurrency", fallback=4)
+        return AsyncCotohaApi(CotohaApi.FromConfig(config_path, rate_limiter), MAX_CONCURRENCY)
+
+    # 全エンドポイント共通のリクエスト処理(同時実行数をmax_concurrencyに抑える)
+    # on_startはスレッドで呼び出しを始める直前に呼ばれる(取り消されて送られなかったものと区別できる)
+    async def Request(self, name: str, path: str, body: dict, on_start=None) -> dict:
+        loop = asyncio.get_running_loop()
+        if self.__semaphore_loop is not loop:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__semaphore_loop = loop
+
+        def Run() -> dict:
+            if on_start is not None:
+                on_start()
+            return self.cotoha_api.Request(name, path, body)
+
+        async with self.__semaphore:
+            return await loop.run_in_executor(self.__executor, Run)
 
-        # レスポンスボディ取得
-        res_body = res.read()
-        # レスポンスボディをJSONからデコード
-        res_body = json.loads(res_body)
-        # レスポンスボディから解析結果を取得
-        return res_body
+    # 構文解析API
+    async def parse(self, sentence):
+        return await self.Request("parse", "v1/parse", {"sentence": sentence})
+
+    # 固有表現抽出API
+    async def ne(self, sentence):
+        return await self.Request("ne", "v1/ne", {"sentence": sentence})
+
+    # 照応解析API
+    async def coreference(self, document):
+        return await self.Request("coreference", "beta/coreference", {"document": document})
+
+    # キーワード抽出API
+    async def keyword(self, document):
+        return await self.Request("keyword", "v1/keyword", {"document": document})
+
+    # 複数の文書(文の配列)の全リクエストを一度に送り、結果を文書ごとに振り分ける
+    async def __RequestDocuments(self, request, documents: List[List[str]], max_length: int) -> List[List[dict]]:
+        batches = [CotohaApi.PackSentences(sentences, max_length) for sentences in documents]
+        responses = await asyncio.gather(*[request(batch) for document_batches in batches for batch in document_batches])
+        results: List[List[dict]] = []
+        start = 0
+        for document_batches in batches:
+            results.append(responses[start:start + len(document_batches)])
+            start += len(document_batches)
+        return results
+
+    # キーワード抽出API(複数の長い文書): 文書ごとに1つにまとめた結果を返す
+    async def keywordDocuments(self, documents: List[List[str]], max_length: int) -> List[dict]:
+        results = await self.__RequestDocuments(self.keyword, documents, max_length)
+        return [CotohaApi.MergeKeywords(responses) for responses in results]
+
+    # 照応解析API(複数の長い文書): 文書ごとに、まとめて送った単位の結果を返す
+    async def coreferenceDocuments(self, documents: List[List[str]], max_length: int) -> List[List[dict]]:
+        return await self.__RequestDocuments(self.coreference, documents, max_length)
+
+    # 類似度算出API
+    async def similarity(self, s1, s2, on_start=None):
+        return await self.Request("similarity", "v1/similarity", {"s1": s1, "s2": s2}, on_start)
+
+    # 文タイプ判定API
+    async def sentenceType(self, sentence):
+        return await self.Request("sentenceType", "v1/sentence_type", {"sentence": sentence})
+
+    # ユーザ属性推定API
+    async def userAttribute(self, document):
+        return await self.Request("userAttribute", "beta/user_attribute", {"document": document})
+
+    # 感情分析API
+    async def sentiment(self, sentence):
+        return await self.Request("sentiment", "v1/sentiment", {"sentence": sentence})
+
+    # 要約API
+    async def summary(self, document, sent_len):
+        return await self.Request("summary", "beta/summary", {"document": document, "sent_len": sent_len})
+
+    # スレッドと接続を解放
+    def close(self) -> None:
+        self.__executor.shutdown(wait=True)
+        self.cotoha_api.close()
 
 
 if __name__ == '__main__':
     # ソースファイルの場所取得
     APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + "/"
 
-    # 設定値取得
-    config = configparser.ConfigParser()
-    config.read(APP_ROOT + "config.ini")
-    CLIENT_ID = config.get("COTOHA API", "Developer Client id")
-    CLIENT_SECRET = config.get("COTOHA API", "Developer Client secret")
-    DEVELOPER_API_BASE_URL = config.get("COTOHA API", "Developer API Base URL")
-    ACCESS_TOKEN_PUBLISH_URL = config.get("COTOHA API", "Access Token Publish URL")
-
     # COTOHA APIインスタンス生成
-    cotoha_api = CotohaApi(CLIENT_ID, CLIENT_SECRET, DEVELOPER_API_BASE_URL, ACCESS_TOKEN_PUBLISH_URL)
+    cotoha_api = CotohaApi.FromConfig(APP_ROOT + "config.ini")
 
     # 解析対象文
     sentence = "すもももももももものうち"
@@ -1,262 +1,572 @@
 # -*- coding:utf-8 -*-
 import os
-import time
-import configparser
+import atexit
+import signal
+import functools
+import asyncio
+import argparse
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List
 
 from TopixCore30 import TopixCore30
 from Nikkei255 import Nikkei255
+from AllCompanies import AllCompanies
 
 from CompanyInformation import CompanyInformation
 from CompanyInformation import CompanyInformationRepository
+from CompanyInformationQuery import CompanyInformationQuery
+from TextDivider import TextDivider
+from TextAligner import AlignedPair
+from TextAligner import TextAligner
 from cotoha_api_python3 import CotohaApi
+from cotoha_api_python3 import AsyncCotohaApi
+from cotoha_api_python3 import CotohaApiError
+from cotoha_api_python3 import QuotaExceededError
+from cotoha_api_python3 import RateLimiter
+from BatchJournal import BatchJournal
+from ChunkLimits import ChunkLimits
+from ApiMetrics import ApiMetrics
+from ApiMetrics import MetricsExporter
+from StageProfiler import StageProfiler
+from SimilarityPrescreen import SimilarityPrescreen
+from ReportWriter import ReportWriter
+from ReportWriter import OrderedReportWriter
+
+
+# const
+CHUNK_LIMITS = ChunkLimits.FromConfig(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini'))  # エンドポイントごとのチャンク長
+TARGET_YEAR = 2018
+SIMILARITY_THRESHOLD = 0.8  # これより類似度が低ければ要約を表示
+SIMILARITY_EARLY_EXIT = True  # しきい値のどちら側か決まった時点で類似度APIの呼び出しを打ち切る
+SIMILARITY_PRESCREEN = SimilarityPrescreen.FromConfig(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini'), SIMILARITY_THRESHOLD)
+PROCESS_POOL_SIZE = os.cpu_count() or 1  # 文の対応付けなどローカル処理を行うプロセス数(0ならイベントループ上で実行)
+ANALYZED_SECTIONS = {TARGET_YEAR - 1: ['business_policy_environment_issue_etc_text', 'business_risks_text'],
+                     TARGET_YEAR: ['business_policy_environment_issue_etc_text', 'business_risks_text', 'business_analysis_of_finance_text',
+                                   'business_management_analysis_text', 'business_research_and_development_text']}
+PROFILER = StageProfiler()  # --profileで有効にする
 
 
 def GetCotohaApi() -> CotohaApi:
     APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + '/'
 
-    # 設定値取得
-    config = configparser.ConfigParser()
-    config.read(APP_ROOT + 'config.ini')
-    CLIENT_ID = config.get('COTOHA API', 'Developer Client id')
-    CLIENT_SECRET = config.get('COTOHA API', 'Developer Client secret')
-    DEVELOPER_API_BASE_URL = config.get('COTOHA API', 'Developer API Base URL')
-    ACCESS_TOKEN_PUBLISH_URL = config.get('COTOHA API', 'Access Token Publish URL')
-
     # COTOHA APIインスタンス生成
-    return CotohaApi(CLIENT_ID, CLIENT_SECRET, DEVELOPER_API_BASE_URL, ACCESS_TOKEN_PUBLISH_URL)
+    return CotohaApi.FromConfig(APP_ROOT + 'config.ini')
 
 
-def IsInvalid(data):
-    return data != data
+def GetAsyncCotohaApi(rate_limiter: RateLimiter = None) -> AsyncCotohaApi:
+    APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + '/'
 
+    # COTOHA API非同期インスタンス生成
+    return AsyncCotohaApi.FromConfig(APP_ROOT + 'config.ini', rate_limiter)
 
-def GetDividedSubstring(text: str, max_length: int) -> List[str]:
-    if len(text) < max_length:
-        return [text]
 
-    index = text.rfind('。', 0, max_length)
-    if index < 0:
-        index = text.rfind('\n\n', 0, max_length)  # try to find double newlines
-    if index < 0:
-        if len(text) < max_length:
-            return [text]
-        else:
-            index = max_length
+# 同じ文章を何度も分割しない(直近の文章だけ覚えておく)
+@functools.lru_cache(maxsize=64)
+def GetDividedSubstring(target_text: str, max_text_length: int) -> List[str]:
+    with PROFILER.Measure('chunk'):
+        return TextDivider.GetDividedSubstring(target_text, max_text_length)
 
-    head = text[: index + 1]
-    tail = text[index + 1:]
-    result: List[str] = [head]
-    for text in GetDividedSubstring(tail, max_length):
-        result.append(text)
-    return result
 
+async def GetAlignedPairs(target_text1: str, target_text2: str, max_text_length: int) -> List[AlignedPair]:
+    if process_pool is None:
+        with PROFILER.Measure('chunk'):
+            return TextAligner.GetAlignedPairs(target_text1, target_text2, max_text_length)
 
-def CheckSimilarity(target_text1: str, target_text2: str, max_text_length: int) -> float:
-    # text division
-    sub_texts1 = GetDividedSubstring(target_text1, max_text_length)
-    sub_texts2 = GetDividedSubstring(target_text2, max_text_length)
+    # CPUを使う対応付けはプロセスプールで行い、その間もAPI呼び出しを進める
+    with PROFILER.Measure('chunk', waits=True):
+        return await asyncio.get_running_loop().run_in_executor(process_pool, TextAligner.GetAlignedPairs, target_text1, target_text2, max_text_length)
 
-    texts_size = len(sub_texts1)
-    if len(sub_texts1) != len(sub_texts2):
-        # print('  text division failed')
-        texts_size = texts_size if len(sub_texts1) < len(sub_texts2) else len(sub_texts2)
+
+async def GetWeightedSimilarity(target_text1: str, target_text2: str, max_text_length: int) -> float:
+    # align sentences between the two years (identical passages need no API call)
+    aligned_pairs = await GetAlignedPairs(target_text1, target_text2, max_text_length)
+    changed_pairs = [pair for pair in aligned_pairs if not pair.identical]
 
     text_length = len(target_text1) if len(target_text1) > len(target_text2) else len(target_text2)
 
-    total_similarity: float = 0
+    # send all changed pairs at once (results keep the pair order)
+    with PROFILER.Measure('api', waits=True):
+        similarities = await asyncio.gather(*[cotoha_api.similarity(pair.text1, pair.text2) for pair in changed_pairs])
+
+    with PROFILER.Measure('aggregate'):
+        total_similarity: float = 0
+
+        for pair in aligned_pairs:
+            if pair.identical:
+                total_similarity += float(len(pair.text1)) / text_length
+
+        for pair, similarity in zip(changed_pairs, similarities):
+            if 'result' not in similarity:
+                continue
+            total_similarity += similarity['result']['score'] * float(len(pair.text1)) / text_length
+    return total_similarity
+
+
+# 早期打ち切りで送った/送らずに済んだ類似度APIの呼び出し数
+similarity_stats = {'similarity_sent': 0, 'similarity_skipped': 0}
 
-    for text_index in range(texts_size):
-        text1 = sub_texts1[text_index]
-        text2 = sub_texts2[text_index]
 
-        similarity = cotoha_api.similarity(text1, text2)
-        if 'result' not in similarity:
-            continue
-        total_similarity += similarity['result']['score'] * float(len(text1)) / text_length
-        time.sleep(0.1)
+# 類似度がしきい値を下回るかを、全ての組を送らずに判定する
+# 重みの大きい組から送り、結果が届くたびに合計の下限(未回答を0)と上限(未回答を1)を更新して、しきい値のどちら側か決まったら残りは送らない
+# (しきい値を下回るか, 判定した側の下限/上限, 送らずに済んだ呼び出し数)を返す
+async def CheckSimilarityDecision(target_text1: str, target_text2: str, max_text_length: int, threshold: float) -> (bool, float, int):
+    aligned_pairs = await GetAlignedPairs(target_text1, target_text2, max_text_length)
+    changed_pairs = sorted([pair for pair in aligned_pairs if not pair.identical], key=lambda pair: -len(pair.text1))
 
+    text_length = len(target_text1) if len(target_text1) > len(target_text2) else len(target_text2)
+    if text_length == 0:
+        return 0.0 < threshold, 0.0, 0
+    threshold_length = threshold * text_length  # 文字数で比べる
+
+    lower_length: float = sum(len(pair.text1) for pair in aligned_pairs if pair.identical)
+    remaining_length: int = sum(len(pair.text1) for pair in changed_pairs)  # まだ結果の届いていない組の文字数
+
+    # 実際に呼び出しを始めた組(取り消しが間に合って送らなかった組は含まない)
+    started_pairs: List[AlignedPair] = []
+
+    async def RequestSimilarity(pair: AlignedPair) -> (AlignedPair, dict):
+        return pair, await cotoha_api.similarity(pair.text1, pair.text2, functools.partial(started_pairs.append, pair))
+
+    submitted_count = 0
+    done = set()
+    pending = set()
+    try:
+        while lower_length < threshold_length <= lower_length + remaining_length:
+            # 同時実行数の分だけ先に送っておく
+            while submitted_count < len(changed_pairs) and len(pending) < cotoha_api.max_concurrency:
+                pending.add(asyncio.ensure_future(RequestSimilarity(changed_pairs[submitted_count])))
+                submitted_count += 1
+            with PROFILER.Measure('api', waits=True):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pair, similarity = task.result()
+                remaining_length -= len(pair.text1)
+                if 'result' in similarity:
+                    lower_length += similarity['result']['score'] * len(pair.text1)
+    finally:
+        # 決まった時点で待っている呼び出しは取り消す(送信中のものは結果を捨てる)
+        for task in pending:
+            task.cancel()
+        # 失敗した組が複数あっても、最初の例外だけを上へ返し、残りは受け取っておく(未回収の警告を出さない)
+        await asyncio.gather(*done, *pending, return_exceptions=True)
+
+    sent_count = len(started_pairs)
+    skipped_count = len(changed_pairs) - sent_count
+    similarity_stats['similarity_sent'] += sent_count
+    similarity_stats['similarity_skipped'] += skipped_count
+
+    below = lower_length < threshold_length
+    return below, (lower_length + remaining_length if below else lower_length) / text_length, skipped_count
+
+
+async def CheckSimilarity(target_text1: str, target_text2: str, max_text_length: int) -> float:
+    # 明らかにしきい値の上/下にある文章はローカルの類似度で判定し、APIを呼ばない(監査に選ばれたものは呼んで確かめる)
+    local_similarity = None
+    audited = False
+    if SIMILARITY_PRESCREEN is not None:
+        with PROFILER.Measure('filter'):
+            local_similarity, decided, audited = SIMILARITY_PRESCREEN.Screen(target_text1, target_text2)
+        if decided and not audited:
+            return local_similarity
+
+    if SIMILARITY_EARLY_EXIT:
+        _, total_similarity, _ = await CheckSimilarityDecision(target_text1, target_text2, max_text_length, SIMILARITY_THRESHOLD)
+    else:
+        total_similarity = await GetWeightedSimilarity(target_text1, target_text2, max_text_length)
+
+    if local_similarity is not None:
+        SIMILARITY_PRESCREEN.AddApiScore(local_similarity, total_similarity, audited)
     return total_similarity
 
 
-def CheckSummary(target_text: str, max_text_length: int) -> str:
+async def CheckSummary(target_text: str, max_text_length: int) -> str:
     # divide long text
     sub_texts = GetDividedSubstring(target_text, max_text_length)
 
-    summary_result: str = ''
-    for text in sub_texts:
-        summary = cotoha_api.summary(text, max_text_length / 500)
-        if 'result' not in summary:
-            continue
-        summary_result += summary['result']
-        time.sleep(0.1)
+    with PROFILER.Measure('api', waits=True):
+        summaries = await asyncio.gather(*[cotoha_api.summary(text, CHUNK_LIMITS.GetSummarySentences(max_text_length)) for text in sub_texts])
+
+    with PROFILER.Measure('aggregate'):
+        summary_result: str = ''
+        for summary in summaries:
+            if 'result' not in summary:
+                continue
+            summary_result += summary['result']
     return summary_result
 
 
-def CheckSentiment(target_text: str, max_text_length: int) -> Dict[str, float]:
+async def CheckSentiment(target_text: str, max_text_length: int) -> Dict[str, float]:
     # divide long text
     sub_texts = GetDividedSubstring(target_text, max_text_length)
 
-    sentiments: Dict[str, float] = {}
-    for text in sub_texts:
-        sentiment = cotoha_api.sentiment(text)
-        if 'result' not in sentiment:
-            continue
+    with PROFILER.Measure('api', waits=True):
+        results = await asyncio.gather(*[cotoha_api.sentiment(text) for text in sub_texts])
 
-        sentiment_value = sentiment['result']['sentiment']
-        sentiment_score = sentiment['result']['score']
+    with PROFILER.Measure('aggregate'):
+        sentiments: Dict[str, float] = {}
+        for text, sentiment in zip(sub_texts, results):
+            if 'result' not in sentiment:
+                continue
+
+            sentiment_value = sentiment['result']['sentiment']
+            sentiment_score = sentiment['result']['score']
 
-        if sentiment_value not in sentiments:
-            sentiments[sentiment_value] = 0
-        sentiments[sentiment_value] += sentiment_score * float(len(text)) / len(target_text)
-        time.sleep(0.1)
+            if sentiment_value not in sentiments:
+                sentiments[sentiment_value] = 0
+            sentiments[sentiment_value] += sentiment_score * float(len(text)) / len(target_text)
 
     return sentiments
 
 
-def CheckNe(target_text: str, max_text_length: int) -> List[str]:
+async def CheckNe(target_text: str, max_text_length: int) -> List[str]:
     # divide long text
     sub_texts = GetDividedSubstring(target_text, max_text_length)
 
-    words: List[str] = []
-    for text in sub_texts:
-        ne = cotoha_api.ne(text)
-        if 'result' not in ne:
-            continue
+    with PROFILER.Measure('api', waits=True):
+        results = await asyncio.gather(*[cotoha_api.ne(text) for text in sub_texts])
+
+    with PROFILER.Measure('aggregate'):
+        words: List[str] = []
+        for ne in results:
+            if 'result' not in ne:
+                continue
 
-        for dict_index in range(len(ne['result'])):
-            word_class = ne['result'][dict_index]['class']
-            if word_class == 'ART' or word_class == 'PSN' or word_class == 'LOC':
-                word = ne['result'][dict_index]['form']
-                if word not in words:  # Unique
-                    words.append(ne['result'][dict_index]['form'])
-        time.sleep(0.1)
+            for dict_index in range(len(ne['result'])):
+                word_class = ne['result'][dict_index]['class']
+                if word_class == 'ART' or word_class == 'PSN' or word_class == 'LOC':
+                    word = ne['result'][dict_index]['form']
+                    if word not in words:  # Unique
+                        words.append(ne['result'][dict_index]['form'])
 
     return words
 
 
+async def AnalyzeCompany(five_digit_code: int, infoDict: Dict[int, CompanyInformation]) -> dict:
+    # 本文の読み込み(以降はメモリ上の文字列を使う)
+    with PROFILER.Measure('load'):
+        for year, sections in ANALYZED_SECTIONS.items():
+            for section in sections:
+                getattr(infoDict[year], section)
+
+    # 類似度
+    business_policy_environment_issue_etc_similarity, business_risks_similarity = await asyncio.gather(
+        CheckSimilarity(
+            infoDict[TARGET_YEAR - 1].business_policy_environment_issue_etc_text,
+            infoDict[TARGET_YEAR].business_policy_environment_issue_etc_text,
+            CHUNK_LIMITS.Get('similarity')),
+        CheckSimilarity(
+            infoDict[TARGET_YEAR - 1].business_risks_text,
+            infoDict[TARGET_YEAR].business_risks_text,
+            CHUNK_LIMITS.Get('similarity')))
+
+    # 類似度が低い場合に要約
+    business_policy_environment_issue_etc_summary = None
+    if business_policy_environment_issue_etc_similarity < SIMILARITY_THRESHOLD:
+        business_policy_environment_issue_etc_summary = await CheckSummary(infoDict[TARGET_YEAR].business_policy_environment_issue_etc_text, CHUNK_LIMITS.Get('summary'))
+    business_risks_summary = None
+    if business_risks_similarity < SIMILARITY_THRESHOLD:
+        business_risks_summary = await CheckSummary(infoDict[TARGET_YEAR].business_risks_text, CHUNK_LIMITS.Get('summary'))
+
+    # 感情分析
+    analysis_text = infoDict[TARGET_YEAR].business_analysis_of_finance_text + infoDict[TARGET_YEAR].business_management_analysis_text
+    sentiment = await CheckSentiment(analysis_text, CHUNK_LIMITS.Get('sentiment'))
+    sorted_sentiment = sorted(sentiment.items(), key=lambda x: -x[1])
+
+    contradicted = False  # 矛盾判定
+    if len(sorted_sentiment) > 0:
+        contradicted = infoDict[TARGET_YEAR].operating_income > infoDict[TARGET_YEAR - 1].operating_income
+        contradicted = contradicted or infoDict[TARGET_YEAR].operating_income > infoDict[TARGET_YEAR - 1].operating_income
+        contradicted = contradicted and list(sorted_sentiment[0])[0] == 'Negative'
+
+    # 営業利益/経常利益が増えているにも関わらずネガティブな場合は原文
+    analysis_original = None
+    analysis_summary = None
+    if contradicted:
+        analysis_original = analysis_text
+    else:
+        analysis_summary = await CheckSummary(analysis_text, CHUNK_LIMITS.Get('summary'))
+
+    # 固有表現抽出
+    ne = await CheckNe(infoDict[TARGET_YEAR].business_research_and_development_text, CHUNK_LIMITS.Get('ne'))
+    research_and_development_summary = await CheckSummary(infoDict[TARGET_YEAR].business_research_and_development_text, CHUNK_LIMITS.Get('summary'))
+
+    return {
+        'code': five_digit_code,
+        'year': TARGET_YEAR,
+        'name': infoDict[TARGET_YEAR].name,
+        'net_sales': [float(infoDict[TARGET_YEAR - 1].net_sales), float(infoDict[TARGET_YEAR].net_sales)],
+        'operating_income': [float(infoDict[TARGET_YEAR - 1].operating_income), float(infoDict[TARGET_YEAR].operating_income)],
+        'ordinary_income': [float(infoDict[TARGET_YEAR - 1].ordinary_income), float(infoDict[TARGET_YEAR].ordinary_income)],
+        'business_policy_environment_issue_etc_similarity': business_policy_environment_issue_etc_similarity,
+        'business_risks_similarity': business_risks_similarity,
+        'business_policy_environment_issue_etc_summary': business_policy_environment_issue_etc_summary,
+        'business_risks_summary': business_risks_summary,
+        'sentiment': sentiment,
+        'contradicted': bool(contradicted),
+        'analysis_original': analysis_original,
+        'analysis_summary': analysis_summary,
+        'ne': ne,
+        'research_and_development_summary': research_and_development_summary
+    }
+
+
+async def TryAnalyzeCompany(five_digit_code: int, infoDict: Dict[int, CompanyInformation]) -> dict:
+    StageProfiler.SetCompany(five_digit_code)
+    try:
+        return await AnalyzeCompany(five_digit_code, infoDict)
+    except QuotaExceededError:
+        raise
+    except CotohaApiError as e:
+        # 失敗した会社は記録せず、次回の実行で再処理する
+        print('<Error: {0}> {1}'.format(five_digit_code, e))
+        return None
+
+
+async def AnalyzeCompanies(targets: Dict[int, Dict[int, CompanyInformation]], journal: BatchJournal, report: OrderedReportWriter) -> None:
+    # 同時に処理する会社数を絞り、終わった会社から順にジャーナルとレポートへ記録
+    semaphore = asyncio.Semaphore(cotoha_api.max_concurrency)
+
+    async def AnalyzeCompanyWithLimit(five_digit_code: int, infoDict: Dict[int, CompanyInformation]) -> (int, dict):
+        async with semaphore:
+            return five_digit_code, await TryAnalyzeCompany(five_digit_code, infoDict)
+
+    tasks = [asyncio.ensure_future(AnalyzeCompanyWithLimit(five_digit_code, infoDict)) for five_digit_code, infoDict in targets.items()]
+    try:
+        for task in asyncio.as_completed(tasks):
+            five_digit_code, record = await task
+            with PROFILER.Measure('render', five_digit_code):
+                if record is not None:
+                    journal.Append(record)
+                report.Add(five_digit_code, record)
+    except QuotaExceededError as e:
+        # 上限に達したら残りを打ち切る(記録済みの会社は次回スキップされる)
+        print('<Error: quota> ' + str(e))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# 呼び出し回数の集計(メモで省いた回数とレスポンスキャッシュのヒット数)
+def GetCallStats() -> Dict[str, int]:
+    stats = {'memo_saved': cotoha_api.cotoha_api.memo.saved_count}
+    response_cache = cotoha_api.cotoha_api.response_cache
+    if response_cache is not None:
+        stats['cache_hits'] = response_cache.hits
+        stats['cache_misses'] = response_cache.misses
+    if SIMILARITY_PRESCREEN is not None:
+        stats.update(SIMILARITY_PRESCREEN.GetStats())
+    if SIMILARITY_EARLY_EXIT:
+        stats.update(similarity_stats)
+    return stats
+
+
+def PrintCallStats(stats: Dict[str, int]) -> None:
+    if 'cache_hits' in stats:
+        print('response cache: hits={0}, misses={1}'.format(stats['cache_hits'], stats['cache_misses']))
+    print('memo: saved {0} calls'.format(stats.get('memo_saved', 0)))  # ワーカーが1社も終えなければ空
+    if 'prescreen_checked' in stats:
+        print('similarity prescreen: skipped {0}/{1} ({2:.1%}), audit agreed with API {3}/{4}, uncertain band agreed {5}/{6}'.format(
+            stats['prescreen_skipped'], stats['prescreen_checked'], stats['prescreen_skipped'] / max(stats['prescreen_checked'], 1),
+            stats['prescreen_audit_agreed'], stats['prescreen_audited'], stats['prescreen_agreed'], stats['prescreen_compared']))
+    if 'similarity_sent' in stats:
+        print('similarity early exit: skipped {0}/{1} calls'.format(
+            stats['similarity_skipped'], stats['similarity_sent'] + stats['similarity_skipped']))
+
+
+# エンドポイントごとの呼び出し回数と応答時間
+def PrintMetrics(metrics: ApiMetrics) -> None:
+    snapshot = metrics.GetSnapshot()
+    for name in metrics.GetEndpoints():
+        values = snapshot[name]
+        quantiles = [quantile * 1000 if quantile is not None else 0 for quantile in metrics.GetQuantiles(name).values()]
+        print('{0:>13}: calls={1}, sent={2}, cache hits={3}, retries={4}, errors={5}, empty={6}, chars={7}, '
+              'p50={8:.1f}ms, p95={9:.1f}ms, p99={10:.1f}ms'.format(
+                  name, values['calls'], values['sent'], values['cache_hits'], values['retries'], values['errors'],
+                  values['empty_results'], values['chars'], *quantiles))
+
+
+# 段階ごとの時間(全体と、時間のかかった会社)
+def PrintProfile(profiler: StageProfiler, company_count: int = 5) -> None:
+    wall, cpu = profiler.GetElapsed()
+    print('profile: wall={0:.2f}s, cpu={1:.2f}s'.format(wall, cpu))
+    for stage, (count, stage_wall, stage_cpu, memory) in profiler.GetRunTotals().items():
+        print('{0:>13}: count={1}, wall={2:.3f}s, cpu={3:.3f}s, memory={4:+.1f}MB'.format(stage, count, stage_wall, stage_cpu, memory / 1024 / 1024))
+    companies = sorted(profiler.GetCompanies().items(), key=lambda item: -sum(values[1] for values in item[1].values()))
+    for company, stages in companies[:company_count]:
+        print('{0:>13}: {1}'.format(company, ', '.join('{0}={1:.3f}s'.format(stage, stages[stage][1])
+                                                      for stage in StageProfiler.STAGES if stage in stages)))
+
+
+# ワーカープロセスの初期化(COTOHA APIのセッションとリポジトリはプロセスごとに作る)
+# profile_optionsは(tracemallocを使うか, cProfileを取る段階, cProfileの出力先)でNoneならプロファイルしない
+def InitializeWorker(rate_limiter: RateLimiter, profile_options: tuple = None) -> None:
+    global cotoha_api, process_pool, cir, worker_loop
+
+    cotoha_api = GetAsyncCotohaApi(rate_limiter)
+    atexit.register(cotoha_api.close)
+    process_pool = None  # 文の対応付けもワーカー内で行う
+
+    if profile_options is not None:
+        trace_memory, cprofile_stage, cprofile_path = profile_options
+        PROFILER.Enable(trace_memory, cprofile_stage)
+        if cprofile_stage is not None:
+            atexit.register(PROFILER.DumpProfile, '{0}.{1}'.format(cprofile_path, os.getpid()))
+
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    cir = {year: CompanyInformationRepository(data_directory, year) for year in [TARGET_YEAR - 1, TARGET_YEAR]}
+
+    # 会社ごとにループを作り直さないよう、1つのループを使い回す
+    worker_loop = asyncio.new_event_loop()
+
+
+# 1社分をワーカープロセスで処理し、記録とこの1社分の呼び出し回数、メトリクス、段階ごとの時間を返す
+# CompanyInformationは本文の読み込み関数を持ちpickleできないので、銘柄コードだけを受け渡す
+def AnalyzeCompanyInWorker(five_digit_code: int) -> (dict, Dict[str, int], Dict[str, dict], Dict[int, Dict[str, List[float]]]):
+    with PROFILER.Measure('load', five_digit_code):
+        infoDict = {year: cir[year].Get(five_digit_code) for year in [TARGET_YEAR - 1, TARGET_YEAR]}
+    stats = GetCallStats()
+    record = worker_loop.run_until_complete(TryAnalyzeCompany(five_digit_code, infoDict))
+    return (record, {key: value - stats[key] for key, value in GetCallStats().items()}, cotoha_api.cotoha_api.metrics.Collect(),
+            PROFILER.Collect())
+
+
+# ワーカーのメトリクスはmetricsへ、段階ごとの時間はPROFILERへ足し合わせる
+def AnalyzeCompaniesInWorkers(five_digit_codes: List[int], journal: BatchJournal, report: OrderedReportWriter, worker_count: int,
+                              metrics: ApiMetrics, profile_options: tuple = None) -> Dict[str, int]:
+    # レート制限と1日の上限は全ワーカーで共有し、記録は親プロセスだけが行う
+    mp_context = multiprocessing.get_context('spawn')
+    rate_limiter = RateLimiter.FromConfig(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini'), mp_context)
+
+    total_stats: Dict[str, int] = {}
+    with ProcessPoolExecutor(worker_count, mp_context=mp_context, initializer=InitializeWorker, initargs=(rate_limiter, profile_options)) as worker_pool:
+        futures = {worker_pool.submit(AnalyzeCompanyInWorker, five_digit_code): five_digit_code for five_digit_code in five_digit_codes}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                record, stats, worker_metrics, worker_profile = future.result()
+                metrics.Merge(worker_metrics)
+                PROFILER.Merge(worker_profile)
+                with PROFILER.Measure('render', futures[future]):
+                    if record is not None:
+                        journal.Append(record)
+                    report.Add(futures[future], record)
+                for key, value in stats.items():
+                    total_stats[key] = total_stats.get(key, 0) + value
+        except BaseException as e:
+            # 上限到達、中断、その他の失敗のどれでも、処理中の会社だけ待ち、未着手の会社は取り消す
+            # (shutdown(cancel_futures=True)は3.9以降なので自分で取り消す)
+            for future in futures:
+                future.cancel()
+            worker_pool.shutdown()
+            if not isinstance(e, QuotaExceededError):
+                raise
+            print('<Error: quota> ' + str(e))
+    return total_stats
+
+
 if __name__ == '__main__':
 
-    cotoha_api = GetCotohaApi()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('universe', nargs='?', default='nikkei255', choices=['nikkei255', 'topixcore30', 'all'],
+                        help='target companies (all: every filer in documents.csv)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes analyzing companies (0: single process)')
+    parser.add_argument('--report', default=None,
+                        help='report file (default: stdout, *.gz: gzip compressed)')
+    parser.add_argument('--format', default='markdown', choices=ReportWriter.FORMATS,
+                        help='report format')
+    parser.add_argument('--metrics', default=None,
+                        help='per-endpoint API metrics file written periodically and at the end (*.prom: Prometheus text, otherwise JSON)')
+    parser.add_argument('--metrics-interval', type=float, default=60,
+                        help='seconds between metrics file updates (0: only at the end)')
+    parser.add_argument('--profile', default=None,
+                        help='write per-stage (load/filter/chunk/api/aggregate/render) time per company and per run to this JSON file')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='also trace memory allocated in each stage with tracemalloc (slow)')
+    parser.add_argument('--profile-cprofile', default=None, choices=StageProfiler.STAGES,
+                        help='also run cProfile inside this stage (written to <profile>.pstats, one file per worker process)')
+    args = parser.parse_args()
+    if args.profile is None and (args.profile_memory or args.profile_cprofile is not None):
+        parser.error('--profile-memory and --profile-cprofile require --profile')
+
+    profile_options = None
+    if args.profile is not None:
+        PROFILER.Enable(args.profile_memory, args.profile_cprofile)
+        profile_options = (args.profile_memory, args.profile_cprofile, args.profile + '.pstats')
+
+    # killされた場合もCtrl+Cと同じく後始末(レポートのflush)をしてから終わる
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if args.workers == 0:
+        cotoha_api = GetAsyncCotohaApi()
+        process_pool = ProcessPoolExecutor(PROCESS_POOL_SIZE, mp_context=multiprocessing.get_context('spawn')) if PROCESS_POOL_SIZE > 0 else None
+        api_metrics = cotoha_api.cotoha_api.metrics
+    else:
+        api_metrics = ApiMetrics()  # 各ワーカーの分を親で集計
+    if args.metrics is not None:
+        # 中断された場合も終了時に書き出す
+        metrics_exporter = MetricsExporter(api_metrics, args.metrics, args.metrics_interval)
+        atexit.register(metrics_exporter.close)
+    journal = BatchJournal(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main_journal.jsonl'))
 
     years = range(2014, 2018 + 1)
 
     cir: Dict[int, CompanyInformationRepository] = {}
     data_directory = os.path.join(os.path.dirname(__file__), 'data')
-    for year in years:
-        cir[year] = CompanyInformationRepository(data_directory, year)
-
-    # codes = TopixCore30.Get()
-    codes = Nikkei255.Get()
-
-    for code in codes:
-        five_digit_code = code * 10  # 本来は銘柄コードは5桁
-
-        infoDict: Dict[int, CompanyInformation] = {}
+    with PROFILER.Measure('load'):
         for year in years:
-            info: CompanyInformation = cir[year].Get(five_digit_code)
-            if info is None:
-                continue
-            infoDict[year] = info
-
-        # const
-        MAX_TEXT_LENGTH = 2000
-        TARGET_YEAR = 2018
-
-        # check items
-        if TARGET_YEAR not in infoDict:
-            continue
-        if TARGET_YEAR - 1 not in infoDict:
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR].net_sales):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR].operating_income):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR].ordinary_income):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR - 1].net_sales):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR - 1].operating_income):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR - 1].ordinary_income):
-            continue
-        if len(infoDict[TARGET_YEAR].business_policy_environment_issue_etc_text) == 0:
-            continue
-        if len(infoDict[TARGET_YEAR - 1].business_policy_environment_issue_etc_text) == 0:
-            continue
-        if len(infoDict[TARGET_YEAR].business_risks_text) == 0:
-            continue
-        if len(infoDict[TARGET_YEAR - 1].business_risks_text) == 0:
-            continue
-        if len(infoDict[TARGET_YEAR].business_analysis_of_finance_text) == 0 and len(infoDict[TARGET_YEAR].business_management_analysis_text) == 0:
-            continue
-        if len(infoDict[TARGET_YEAR].business_research_and_development_text) == 0:
-            continue
-
-        result_text = '---\n'
-        result_text += '### [{0}]\n'.format(infoDict[TARGET_YEAR].name)
-        result_text += '総売上　: {0:>7.2f}億円({1}) => {2:>7.2f}億円({3})\n'.format(
-            infoDict[TARGET_YEAR - 1].net_sales / 100000000, TARGET_YEAR - 1,
-            infoDict[TARGET_YEAR].net_sales / 100000000, TARGET_YEAR)
-        result_text += '営業利益: {0:>7.2f}億円({1}) => {2:>7.2f}億円({3}), 営業利益率{4:.2f}%({5}) => {6:.2f}%({7})\n'.format(
-            infoDict[TARGET_YEAR - 1].operating_income / 100000000, TARGET_YEAR - 1,
-            infoDict[TARGET_YEAR].operating_income / 100000000, TARGET_YEAR,
-            infoDict[TARGET_YEAR - 1].operating_income / infoDict[TARGET_YEAR - 1].net_sales * 100, TARGET_YEAR - 1,
-            infoDict[TARGET_YEAR].operating_income / infoDict[TARGET_YEAR].net_sales * 100, TARGET_YEAR)
-        result_text += '経常利益: {0:>7.2f}億円({1}) => {2:>7.2f}億円({3}), 経常利益率{4:.2f}%({5}) => {6:.2f}%({7})\n\n'.format(
-            infoDict[TARGET_YEAR - 1].ordinary_income / 100000000, TARGET_YEAR - 1,
-            infoDict[TARGET_YEAR].ordinary_income / 100000000, TARGET_YEAR,
-            infoDict[TARGET_YEAR - 1].ordinary_income / infoDict[TARGET_YEAR - 1].net_sales * 100, TARGET_YEAR - 1,
-            infoDict[TARGET_YEAR].ordinary_income / infoDict[TARGET_YEAR].net_sales * 100, TARGET_YEAR)
-
-        # 類似度
-        business_policy_environment_issue_etc_similarity = CheckSimilarity(
-            infoDict[TARGET_YEAR - 1].business_policy_environment_issue_etc_text,
-            infoDict[TARGET_YEAR].business_policy_environment_issue_etc_text,
-            int(MAX_TEXT_LENGTH / 2))
-        business_risks_similarity = CheckSimilarity(
-            infoDict[TARGET_YEAR - 1].business_risks_text,
-            infoDict[TARGET_YEAR].business_risks_text,
-            int(MAX_TEXT_LENGTH / 2))
-
-        # 類似度が低い場合に要約を表示
-        if business_policy_environment_issue_etc_similarity < 0.8:
-            business_policy_environment_issue_etc = CheckSummary(infoDict[TARGET_YEAR].business_policy_environment_issue_etc_text, MAX_TEXT_LENGTH)
-            result_text += '#### 経営方針、経営環境及び対処すべき課題等\n'
-            result_text += '<details><summary>要約</summary><div>\n{0}\n</div></details>\n'.format(business_policy_environment_issue_etc)
-        if business_risks_similarity < 0.8:
-            business_risks = CheckSummary(infoDict[TARGET_YEAR].business_risks_text, MAX_TEXT_LENGTH)
-            result_text += '#### 事業等のリスク\n'
-            result_text += '<details><summary>## 要約</summary><div>\n{0}\n</div></details>\n'.format(business_risks)
-
-        # 感情分析
-        result_text += '#### 財政状態、経営成績及びキャッシュ・フローの状況の分析\n'
-        sentiment = CheckSentiment(infoDict[TARGET_YEAR].business_analysis_of_finance_text + infoDict[TARGET_YEAR].business_management_analysis_text, MAX_TEXT_LENGTH)
-        sorted_sentiment = sorted(sentiment.items(), key=lambda x: -x[1])
-
-        contradicted = False  # 矛盾判定
-        if len(sorted_sentiment) > 0:
-            contradicted = infoDict[TARGET_YEAR].operating_income > infoDict[TARGET_YEAR - 1].operating_income
-            contradicted = contradicted or infoDict[TARGET_YEAR].operating_income > infoDict[TARGET_YEAR - 1].operating_income
-            contradicted = contradicted and list(sorted_sentiment[0])[0] == 'Negative'
-
-        # 営業利益/経常利益が増えているにも関わらずネガティブな場合
-        if contradicted:
-            original = infoDict[TARGET_YEAR].business_analysis_of_finance_text + infoDict[TARGET_YEAR].business_management_analysis_text
-            result_text += '<details><summary>原文</summary><div>\n{0}\n</div></details>\n'.format(original)
+            cir[year] = CompanyInformationRepository(data_directory, year)
+
+    # 対象銘柄
+    if args.universe == 'all':
+        codes = AllCompanies.Get(cir[TARGET_YEAR])
+    elif args.universe == 'topixcore30':
+        codes = TopixCore30.Get()
+    else:
+        codes = Nikkei255.Get()
+
+    # 数値の欠損と本文の有無を全社まとめて列演算で確認
+    with PROFILER.Measure('filter'):
+        query = CompanyInformationQuery(cir)
+        eligible = query.GetEligible(TARGET_YEAR, [code * 10 for code in codes], {  # 本来は銘柄コードは5桁
+            TARGET_YEAR - 1: ['business_policy_environment_issue_etc', 'business_risks'],
+            TARGET_YEAR: ['business_policy_environment_issue_etc', 'business_risks',
+                          ('business_analysis_of_finance', 'business_management_analysis'),
+                          'business_research_and_development']})
+
+    # レポートは銘柄コード順に、前の会社がそろった所から書き出す
+    eligible_codes = [int(five_digit_code) for five_digit_code in eligible.index]
+    with OrderedReportWriter(ReportWriter(args.report, args.format), eligible_codes) as report:
+        # 前回までに処理済みの会社はジャーナルから書き出してスキップ
+        five_digit_codes: List[int] = []
+        for five_digit_code in eligible_codes:
+            if journal.IsFinished(five_digit_code, TARGET_YEAR):
+                with PROFILER.Measure('render', five_digit_code):
+                    report.Add(five_digit_code, journal.Get(five_digit_code, TARGET_YEAR))
+            else:
+                five_digit_codes.append(five_digit_code)
+
+        if args.workers > 0:
+            stats = AnalyzeCompaniesInWorkers(five_digit_codes, journal, report, args.workers, api_metrics, profile_options)
         else:
-            summary = CheckSummary(infoDict[TARGET_YEAR].business_analysis_of_finance_text + infoDict[TARGET_YEAR].business_management_analysis_text, MAX_TEXT_LENGTH)
-            result_text += '<details><summary>要約</summary><div>\n{0}\n</div></details>\n'.format(summary)
-
-        # 固有表現抽出
-        result_text += '#### 研究開発活動\n'
-        ne = CheckNe(infoDict[TARGET_YEAR].business_research_and_development_text, MAX_TEXT_LENGTH)
-        result_text += '<details><summary>キーワード</summary><div>\n{0}\n</div></details>\n'.format(ne)
-        summary = CheckSummary(infoDict[TARGET_YEAR].business_research_and_development_text, MAX_TEXT_LENGTH)
-        result_text += '<details><summary>要約</summary><div>\n{0}\n</div></details>\n'.format(summary)
-
-        result_text += '---\n'
-
-        # with open('main_result.txt', mode='a', encoding='UTF-8') as f:
-        #     f.write(result_text)
-        print(result_text)
+            targets: Dict[int, Dict[int, CompanyInformation]] = {}
+            for five_digit_code in five_digit_codes:
+                with PROFILER.Measure('load', five_digit_code):
+                    targets[five_digit_code] = {year: cir[year].Get(five_digit_code) for year in [TARGET_YEAR - 1, TARGET_YEAR]}
+            asyncio.run(AnalyzeCompanies(targets, journal, report))
+            stats = GetCallStats()
+    journal.close()
+
+    PrintCallStats(stats)
+    PrintMetrics(api_metrics)
+    if args.metrics is not None:
+        metrics_exporter.close()
+    if args.profile is not None:
+        PrintProfile(PROFILER)
+        PROFILER.Write(args.profile)
+        PROFILER.DumpProfile(args.profile + '.pstats')
+    if args.workers == 0:
+        if process_pool is not None:
+            process_pool.shutdown()
+        cotoha_api.close()
@@ -1,7 +1,6 @@
 # -*- coding:utf-8 -*-
 import os
-import time
-import configparser
+import asyncio
 import json
 from enum import Enum
 from typing import Dict, List
@@ -11,54 +10,36 @@ from Nikkei255 import Nikkei255
 
 from CompanyInformation import CompanyInformation
 from CompanyInformation import CompanyInformationRepository
+from CompanyInformationQuery import CompanyInformationQuery
+from TextDivider import TextDivider
+from ChunkLimits import ChunkLimits
 from cotoha_api_python3 import CotohaApi
+from cotoha_api_python3 import AsyncCotohaApi
+from cotoha_api_python3 import CotohaApiError
 
 
 def GetCotohaApi() -> CotohaApi:
     APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + '/'
 
-    # 設定値取得
-    config = configparser.ConfigParser()
-    config.read(APP_ROOT + 'config.ini')
-    CLIENT_ID = config.get('COTOHA API', 'Developer Client id')
-    CLIENT_SECRET = config.get('COTOHA API', 'Developer Client secret')
-    DEVELOPER_API_BASE_URL = config.get('COTOHA API', 'Developer API Base URL')
-    ACCESS_TOKEN_PUBLISH_URL = config.get('COTOHA API', 'Access Token Publish URL')
-
     # COTOHA APIインスタンス生成
-    return CotohaApi(CLIENT_ID, CLIENT_SECRET, DEVELOPER_API_BASE_URL, ACCESS_TOKEN_PUBLISH_URL)
-
-
-def IsInvalid(data):
-    return data != data
+    return CotohaApi.FromConfig(APP_ROOT + 'config.ini')
 
 
-def GetDividedSubstring(text: str, max_length: int) -> List[str]:
-    if len(text) < max_length:
-        return [text]
-
-    index = text.rfind('。', 0, max_length)
-    if index < 0:
-        index = text.rfind('\n\n', 0, max_length)  # try to find double newlines
-    if index < 0:
-        if len(text) < max_length:
-            return [text]
-        else:
-            index = max_length
+def GetAsyncCotohaApi() -> AsyncCotohaApi:
+    APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + '/'
 
-    head = text[: index + 1]
-    tail = text[index + 1:]
-    result: List[str] = [head]
-    for text in GetDividedSubstring(tail, max_length):
-        result.append(text)
-    return result
+    # COTOHA API非同期インスタンス生成
+    return AsyncCotohaApi.FromConfig(APP_ROOT + 'config.ini')
 
 
-def CheckUserAttribute(target_text: str, max_text_length: int) -> (Dict[str, float], Dict[str, float], Dict[str, float], Dict[str, float], Dict[str, float],
-                                                                   Dict[str, float], Dict[str, float], Dict[str, float], Dict[str, float],
-                                                                   Dict[str, float], Dict[str, float], Dict[str, float]):
+async def CheckUserAttribute(target_text: str, max_text_length: int) -> (Dict[str, float], Dict[str, float], Dict[str, float], Dict[str, float], Dict[str, float],
+                                                                         Dict[str, float], Dict[str, float], Dict[str, float], Dict[str, float],
+                                                                         Dict[str, float], Dict[str, float], Dict[str, float]):
     # divide long text
-    sub_texts = GetDividedSubstring(target_text, max_text_length)
+    sub_texts = TextDivider.GetDividedSubstring(target_text, max_text_length)
+
+    # send all chunks at once (results keep the chunk order)
+    user_attributes = await asyncio.gather(*[cotoha_api.userAttribute(text) for text in sub_texts])
 
     age: Dict[str, float] = {}
     civilstatus: Dict[str, float] = {}
@@ -74,8 +55,7 @@ def CheckUserAttribute(target_text: str, max_text_length: int) -> (Dict[str, flo
     position: Dict[str, float] = {}
 
     # print(company_name + ': {0}(length: {1})'.format(year, len(target_text)))
-    for text in sub_texts:
-        user_attribute = cotoha_api.userAttribute(text)
+    for text, user_attribute in zip(sub_texts, user_attributes):
         if 'result' not in user_attribute:
             # print('  {0} => {1}(length: {2})'.format(company_name, year, len(text)))
             continue
@@ -429,6 +409,8 @@ if __name__ == '__main__':
     # check if data save mode
     if data_save_mode_flag:
         companies_json = json.loads('{}')
+        target_names: List[str] = []
+        target_texts: List[str] = []
 
     # check if data USE mode
     if not data_save_mode_flag:
@@ -438,7 +420,7 @@ if __name__ == '__main__':
         unprofittable_companies: List[CompanyAnalysis] = []
 
     # Get COTOHA
-    cotoha_api = GetCotohaApi()
+    cotoha_api = GetAsyncCotohaApi()
 
     # data retrieving
     years = range(2014, 2018 + 1)
@@ -450,48 +432,26 @@ if __name__ == '__main__':
     # codes = TopixCore30.Get()
     codes = Nikkei255.Get()
 
-    for code in codes:
-        five_digit_code = code * 10  # 本来は銘柄コードは5桁
-
-        infoDict: Dict[int, CompanyInformation] = {}
-        for year in years:
-            info: CompanyInformation = cir[year].Get(five_digit_code)
-            if info is None:
-                continue
-            infoDict[year] = info
+    # parameters
+    MAX_TEXT_LENGTH = ChunkLimits.FromConfig(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')).Get('userAttribute')
+    TARGET_YEAR = 2018
 
-        # parameters
-        MAX_TEXT_LENGTH = 1000
-        TARGET_YEAR = 2018
+    # 数値の欠損と本文の有無を全社まとめて列演算で確認
+    query = CompanyInformationQuery(cir)
+    eligible = query.GetEligible(TARGET_YEAR, [code * 10 for code in codes], {  # 本来は銘柄コードは5桁
+        TARGET_YEAR - 1: [('business_analysis_of_finance', 'business_management_analysis')],
+        TARGET_YEAR: [('business_analysis_of_finance', 'business_management_analysis')]})
 
-        # check items
-        if TARGET_YEAR not in infoDict:
-            continue
-        if TARGET_YEAR - 1 not in infoDict:
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR].net_sales):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR].operating_income):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR].ordinary_income):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR - 1].net_sales):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR - 1].operating_income):
-            continue
-        if IsInvalid(infoDict[TARGET_YEAR - 1].ordinary_income):
-            continue
-        if len(infoDict[TARGET_YEAR].business_analysis_of_finance_text) == 0 and len(infoDict[TARGET_YEAR].business_management_analysis_text) == 0:
-            continue
-        if len(infoDict[TARGET_YEAR - 1].business_analysis_of_finance_text) == 0 and len(infoDict[TARGET_YEAR - 1].business_management_analysis_text) == 0:
-            continue
+    for five_digit_code in eligible.index:
+        five_digit_code = int(five_digit_code)
+        infoDict: Dict[int, CompanyInformation] = {year: cir[year].Get(five_digit_code) for year in [TARGET_YEAR - 1, TARGET_YEAR]}
 
         # save or use
         if data_save_mode_flag:
-            user_attribute = CheckUserAttribute(infoDict[TARGET_YEAR - 1].business_management_analysis_text + infoDict[TARGET_YEAR - 1].business_analysis_of_finance_text, MAX_TEXT_LENGTH)
-            # user_attribute = CheckUserAttribute(infoDict[TARGET_YEAR].business_management_analysis_text + infoDict[TARGET_YEAR].business_analysis_of_finance_text, MAX_TEXT_LENGTH)
-            ua = UserAttribute(*user_attribute)
-            companies_json.update(ua.GetJsonAs(infoDict[TARGET_YEAR].name))
+            # API呼び出しはループ後に全社分まとめて実行
+            target_names.append(infoDict[TARGET_YEAR].name)
+            target_texts.append(infoDict[TARGET_YEAR - 1].business_management_analysis_text + infoDict[TARGET_YEAR - 1].business_analysis_of_finance_text)
+            # target_texts.append(infoDict[TARGET_YEAR].business_management_analysis_text + infoDict[TARGET_YEAR].business_analysis_of_finance_text)
         else:
             try:
                 ua = UserAttribute.FromJson(json_data, infoDict[TARGET_YEAR].name)
@@ -514,7 +474,21 @@ if __name__ == '__main__':
             # company.ShowOverview()
 
     if data_save_mode_flag:
+        async def CheckUserAttributes() -> list:
+            return await asyncio.gather(*[CheckUserAttribute(text, MAX_TEXT_LENGTH) for text in target_texts], return_exceptions=True)
+
+        for name, user_attribute in zip(target_names, asyncio.run(CheckUserAttributes())):
+            if isinstance(user_attribute, CotohaApiError):
+                # 失敗した会社は保存しない
+                print('<Error: {0}> {1}'.format(name, user_attribute))
+                continue
+            if isinstance(user_attribute, Exception):
+                raise user_attribute
+            ua = UserAttribute(*user_attribute)
+            companies_json.update(ua.GetJsonAs(name))
         UserAttribute.SaveJson(companies_json, 'all_json.json')
     else:
         GetDifferences(profittable_companies, unprofittable_companies)
         CheckFutureOfCompanies()
+
+    cotoha_api.close()